@@ -3,15 +3,50 @@
 // Using hardware serial, not USB CDC
 #define Serial Serial1
 
+#define ASCII_BAUDRATE 9600
+#define ASCII_INTERVAL 90 // ms between ascii samples
+
 //HX711 constructor (dout pin, sck pin)
 HX711_ADC LoadCell(10, 11);
 
 long t;
 
+// binary frame: 0xA5 0x5A, uint16 counter, uint32 millis, float32 reading, uint16 crc (all little-endian)
+#define FRAME_SIZE 14
+bool binaryMode = false;
+uint16_t frameCounter = 0;
+
+
+uint16_t crc16(const uint8_t *data, uint8_t len) {
+  // CRC-16/CCITT-FALSE, matches python's binascii.crc_hqx(data, 0xFFFF)
+  uint16_t crc = 0xFFFF;
+  for (uint8_t i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t b = 0; b < 8; b++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void sendFrame(float value) {
+  uint8_t frame[FRAME_SIZE];
+  unsigned long now = millis();
+
+  frame[0] = 0xA5;
+  frame[1] = 0x5A;
+  memcpy(frame + 2, &frameCounter, 2);
+  memcpy(frame + 4, &now, 4);
+  memcpy(frame + 8, &value, 4);
+  uint16_t crc = crc16(frame + 2, 10);
+  memcpy(frame + 12, &crc, 2);
 
+  Serial.write(frame, FRAME_SIZE);
+  frameCounter++;
+}
 
 void setup() {
-  Serial.begin(9600);
+  Serial.begin(ASCII_BAUDRATE);
   Serial.println("#Wait...");
   LoadCell.begin();
   long stabilisingtime = 2000; // tare preciscion can be improved by adding a few seconds of stabilising time
@@ -23,10 +58,15 @@ void setup() {
 void loop() {
   //update() should be called at least as often as HX711 sample rate; >10Hz@10SPS, >80Hz@80SPS
   //longer delay in scetch will reduce effective sample rate (be carefull with delay() in loop)
-  LoadCell.update();
+  uint8_t converted = LoadCell.update();
 
-  //get smoothed value from data set + current calibration factor
-  if (millis() > t + 90) {
+  if (binaryMode) {
+    //a frame per every conversion, at the full HX711 sample rate
+    if (converted) {
+      sendFrame(LoadCell.getData());
+    }
+  } else if (millis() > t + ASCII_INTERVAL) {
+    //get smoothed value from data set + current calibration factor
     float i = LoadCell.getData();
     Serial.println(i);
     t = millis();
@@ -38,17 +78,34 @@ void loop() {
     char inByte = Serial.read();
     if (inByte == 't') {
       LoadCell.tareNoDelay();
-      Serial.println("#tare request set");
+      if (!binaryMode) Serial.println("#tare request set");
     }
     if (inByte == 'c'){
       int parsedInt = Serial.parseInt();
       LoadCell.setCalFactor(parsedInt);
-      Serial.println("#calibration complete at " + String(parsedInt));
+      if (!binaryMode) Serial.println("#calibration complete at " + String(parsedInt));
+    }
+    if (inByte == 'b') {
+      //switch to binary frames at the requested baudrate
+      long baudrate = Serial.parseInt();
+      Serial.println("#binary " + String(baudrate));
+      Serial.flush();
+      Serial.end();
+      Serial.begin(baudrate);
+      frameCounter = 0;
+      binaryMode = true;
+    }
+    if (inByte == 'a' && binaryMode) {
+      //back to ascii lines
+      Serial.flush();
+      Serial.end();
+      Serial.begin(ASCII_BAUDRATE);
+      binaryMode = false;
     }
   }
 
   //check if last tare operation is complete
-  if (LoadCell.getTareStatus() == true) {
+  if (LoadCell.getTareStatus() == true && !binaryMode) {
     Serial.println("#tare complete at " + String(LoadCell.getTareOffset()));
   }
 }
@@ -0,0 +1,79 @@
+"""Which menu recipes can be made, kept up to date as the bottle levels change."""
+import logging
+from threading import Lock
+from typing import Dict, Iterable, List
+
+from mixorama.recipes import Component, Recipe
+
+logger = logging.getLogger(__name__)
+
+UNAVAILABLE = float('-inf')  # headroom of recipes needing a component missing from the bar
+
+
+class MenuAvailability:
+    """Maps each component to the recipes using it and keeps every recipe's headroom:
+    the least ml any of its components would have left after pouring it. A recipe is available
+    while its headroom is positive, see Component.can_use. A component level change recomputes
+    only the recipes using that component."""
+
+    def __init__(self, components: Iterable[Component]):
+        self.components = set(components)
+        self._users = {c: [] for c in self.components}
+        ''':type: Dict[Component, List[Recipe]]'''
+        self._headroom = {}
+        ''':type: Dict[Recipe, float]'''
+        self._listeners = []
+        self._lock = Lock()
+
+        for component in self.components:
+            component.on_change(self._on_component_change)
+
+    def add(self, recipes: Iterable[Recipe]):
+        with self._lock:
+            for recipe in recipes:
+                if recipe in self._headroom:
+                    continue
+                for component, _ in recipe:
+                    if component in self._users:
+                        self._users[component].append(recipe)
+                self._headroom[recipe] = self._compute(recipe)
+
+    def on_change(self, callback):
+        """Calls callback(recipe, available) whenever a recipe becomes available or unavailable"""
+        self._listeners.append(callback)
+
+    def headroom(self, recipe: Recipe) -> float:
+        if recipe not in self._headroom:
+            return self._compute(recipe)
+        return self._headroom[recipe]
+
+    def is_available(self, recipe: Recipe) -> bool:
+        return self.headroom(recipe) > 0
+
+    def available(self) -> List[Recipe]:
+        return [r for r, headroom in self._headroom.items() if headroom > 0]
+
+    def __contains__(self, recipe: Recipe):
+        return recipe in self._headroom
+
+    def _compute(self, recipe: Recipe) -> float:
+        headroom = float('inf')
+        for component, volume in recipe:
+            if component not in self.components:
+                return UNAVAILABLE
+            headroom = min(headroom, component.volume - component.spent - volume)
+        return headroom
+
+    def _on_component_change(self, component: Component, event: str, volume):
+        changes = []
+        with self._lock:
+            for recipe in self._users.get(component, ()):
+                was_available = self._headroom[recipe] > 0
+                self._headroom[recipe] = self._compute(recipe)
+                if was_available != (self._headroom[recipe] > 0):
+                    changes.append((recipe, not was_available))
+
+        for recipe, available in changes:
+            logger.debug('%s is %s', recipe.name, 'available' if available else 'unavailable')
+            for callback in self._listeners:
+                callback(recipe, available)
@@ -1,21 +1,31 @@
+import asyncio
 import os
+from collections import OrderedDict
+from concurrent.futures import Future
 from enum import IntEnum, unique
-from time import sleep
-from typing import Dict
+from typing import Dict, Iterable
 import logging
+from mixorama.availability import MenuAvailability
+from mixorama.engine import Engine
+from mixorama.flow import FlowModels, ParallelPourTracker, SettleTracker
 from mixorama.io import Valve
+from mixorama.metrics import LATENCY_BUCKETS, REGISTRY
+from mixorama.plan import PourPlan, PourStep, compile_plan
 from mixorama.recipes import Component, Recipe
-from mixorama.util import MaxObserver
+from mixorama.util import MaxObserver, now
 from mixorama.scales import Scales, ScalesTimeoutException, WaitingForWeightAbortedException, ScalesException
 from mixorama.statemachine import sm_transition, StateMachineCallbacks
 
 GLASS_WEIGHT = 150  # grams
 USER_TAKE_GLASS_TIMEOUT = 10000 if 'MOCK_SCALES' not in os.environ else 0  # msec
-MEASURING_INERTIA = 10  # grams, that the scales don't see when the valve closes
-POURING_TIMEOUT_PER_ML = 400  # ms to push 1 ml
+SETTLE_TIMEOUT = 2000  # ms to wait for the liquid in flight to land after closing the valves
 
 logger = logging.getLogger(__name__)
 
+VALVE_CLOSE_REACTION = REGISTRY.histogram(
+    'mixorama_valve_close_reaction_seconds', 'From the arrival of the sample reaching a target to closing the valve',
+    ['component'], buckets=LATENCY_BUCKETS)
+
 
 @unique
 class BartenderState(IntEnum):
@@ -37,64 +47,151 @@ class OutOfComponent(CocktailAbortedException):
 
 class Bartender(StateMachineCallbacks):
     _sm_state = BartenderState.IDLE
-    _abort = False
+    _glass_weight = 0
+    ''':type: float, grams poured into the glass since its tare'''
+    _taring = None
+    ''':type: asyncio.Future, a tare of the empty scales in progress, the next drink waits for it'''
 
-    def __init__(self, components: Dict[Component, Valve], compressor: Valve, scales: Scales):
+    def __init__(self, components: Dict[Component, Valve], compressor: Valve, scales: Scales,
+                 flow_models: FlowModels = None, parallel_pour=False, engine: Engine = None, dense_first=False):
         self.components = components
         self.scales = scales
         self.compressor = compressor
+        self.flow_models = flow_models if flow_models is not None else FlowModels()
+        self.parallel_pour = parallel_pour
+        self.dense_first = dense_first
+        self.plans = {}
+        ''':type: Dict[Recipe, PourPlan]'''
+        self.engine = engine or Engine()
+        self.availability = MenuAvailability(components)
+
+    @property
+    def glass_weight(self):
+        """grams poured into the glass since its tare, as of the last settled pour"""
+        return self._glass_weight
 
     def can_make_drink(self, recipe: Recipe):
-        for component, volume in recipe:
-            if component not in self.components or not component.can_use(volume):
-                return False
+        return self.availability.is_available(recipe)
+
+    def compile_plans(self, recipes: Iterable[Recipe]):
+        recipes = list(recipes)
+        self.availability.add(recipes)
+        for recipe in recipes:
+            self.plan(recipe)
+
+    def plan(self, recipe: Recipe) -> PourPlan:
+        if recipe not in self.plans:
+            self.plans[recipe] = compile_plan(recipe, self.flow_models, self.parallel_pour, self.dense_first)
+        return self.plans[recipe]
+
+    def _invalidate_plans(self, components):
+        """Drops the plans pouring the components, their timeouts and parallel steps follow the flow models"""
+        for recipe in [r for r in list(self.plans) if any(c in components for c, _ in r)]:
+            self.plans.pop(recipe, None)
+
+    def prepare(self, recipe: Recipe) -> Future:
+        """Gets ready for the next drink while the current one is being served, queued on the engine"""
+        return self.engine.submit(self._prepare_async(recipe))
+
+    async def _prepare_async(self, recipe: Recipe):
+        if self._sm_state not in (BartenderState.READY, BartenderState.IDLE):
+            logger.debug('Not preparing %s while %s', recipe.name, self._sm_state.name)
+            return False
+        self.plan(recipe)
+        self.compressor.open()  # pre-pressurizing, the valves are closed
+        return True
 
+    def unprepare(self) -> Future:
+        return self.engine.submit(self._unprepare_async())
+
+    async def _unprepare_async(self):
+        if self._sm_state in (BartenderState.MAKING, BartenderState.POURING, BartenderState.POURING_PROGRESS):
+            return False  # the compressor belongs to the drink being made
+        self.compressor.close()
+        return True
+
+    def tare(self) -> Future:
+        """Tares the empty scales, queued on the engine; skipped while a drink is being made or served"""
+        return self.engine.submit(self._tare_async())
+
+    async def _tare_async(self):
+        if self._sm_state != BartenderState.IDLE:
+            logger.info('Not taring the scales while %s', self._sm_state.name)
+            return False
+        self._taring = asyncio.ensure_future(self.scales.reset_async(stabilize=False))
+        try:
+            await self._taring
+        finally:
+            self._taring = None
         return True
 
+    def make_drink(self, recipe: Recipe):
+        """Makes the drink on the engine, blocking the calling thread"""
+        return self.engine.run(self.make_drink_async(recipe=recipe))
+
     @sm_transition(allowed_from=BartenderState.IDLE, when_done=BartenderState.READY,
                    while_working=BartenderState.MAKING, on_exception=BartenderState.ABORTED)
-    def make_drink(self, recipe: Recipe):
+    async def make_drink_async(self, recipe: Recipe):
         if not self.can_make_drink(recipe):
             raise OutOfComponent()
+        if self._taring is not None:
+            await asyncio.wait([self._taring])  # the drink's own reset follows it, not races it
 
-        for component, volume in recipe:
-            self._pour(recipe=recipe, component=component, volume=volume)
-        return True
-
-    @sm_transition(allowed_from=BartenderState.MAKING, while_working=BartenderState.POURING,
-                   when_done=BartenderState.MAKING, on_exception=BartenderState.ABORTED)
-    def _pour(self, recipe: Recipe, component: Component, volume: int):
+        plan = self.plan(recipe)
         try:
-            self.scales.reset()
+            await self.scales.reset_async()  # once per glass, the steps track the cumulative weight
+        except WaitingForWeightAbortedException as e:
+            logger.info('Cocktail making aborted')
+            raise CocktailAbortedException from e
         except ScalesException:
             logger.exception('Error resetting scales')
             raise
+        self._glass_weight = 0
 
+        # pressurized for the whole drink: each valve closes on its predicted cutoff with the pressure on,
+        # the flow models learn the liquid still in flight, rather than venting for 0.5 sec per component
         self.compressor.open()
+        try:
+            for step in plan:
+                if step.parallel:
+                    await self._pour_parallel(recipe=recipe, components=step.components, step=step)
+                else:
+                    (component, volume), = step.components.items()
+                    await self._pour(recipe=recipe, component=component, volume=volume, step=step)
+        finally:
+            self.compressor.close()
+        return True
 
+    @sm_transition(allowed_from=BartenderState.MAKING, while_working=BartenderState.POURING,
+                   when_done=BartenderState.MAKING, on_exception=BartenderState.ABORTED)
+    async def _pour(self, recipe: Recipe, component: Component, volume: int, step: PourStep):
+        flow = self.flow_models[component.name]
+        start_weight = self._glass_weight
+        pour = flow.pour(step.weight)
         pouring_tracker = MaxObserver()
+        poured = False
+        used_weight = None
         try:
             self.components[component].open()
 
-            target_weight = volume * component.density
-            target_weight -= MEASURING_INERTIA  # the pouring system has inertia...
-
-            if self._abort:
-                raise CocktailAbortedException()
-
-            self.scales.wait_for_weight(
-                target_weight,
-                timeout=volume * POURING_TIMEOUT_PER_ML,
-                on_progress=lambda done, volume:
+            await self.scales.wait_for_weight_async(
+                start_weight + step.weight,
+                timeout=step.timeout,
+                until=lambda weight, timestamp: pour.observe(weight - start_weight, timestamp),
+                on_progress=lambda done, target:
                     self._sm_state == BartenderState.POURING and
-                    pouring_tracker.observe(done) and
+                    pouring_tracker.observe(done - start_weight) and
                     self._pour_progress(
                         recipe=recipe,
                         component=component,
-                        done=done,
-                        volume=volume
+                        done=done - start_weight,
+                        volume=target - start_weight
                     )
             )
+            poured = True
+            self._close_valve(component, reacting=True)
+            # settling here rather than in the finally, an abort of the settle aborts the drink
+            used_weight = await self._learn_flow(component, pour, start_weight)
 
         except ScalesTimeoutException as e:
             logger.exception('Target weight is not reached within timeout. '
@@ -104,37 +201,136 @@ class Bartender(StateMachineCallbacks):
             logger.info('Cocktail making aborted')
             raise CocktailAbortedException from e
         finally:
-            self.compressor.close()
-            sleep(0.5)
-            self.components[component].close()
+            if not poured:
+                self._close_valve(component)
+
+            used_weight = used_weight or pouring_tracker.value
+            logger.info('Used: %f ml of %s', used_weight / component.density, component)
+
+    def _close_valve(self, component: Component, reacting=False):
+        """
+        :param reacting: to the latest sample the scales acted on, timing the reaction
+        """
+        if reacting and self.scales.decided_at is not None:
+            VALVE_CLOSE_REACTION.observe(now() - self.scales.decided_at, component=component.name)
+        self.components[component].close()
+
+    async def _settle(self):
+        """Waits for the liquid in flight to land, returns the settled weight in the glass"""
+        try:
+            return await self.scales.wait_for_weight_async(self._glass_weight, SETTLE_TIMEOUT,
+                                                           until=SettleTracker().observe)
+        except ScalesTimeoutException:
+            logger.warning('The weight has not settled within %d ms', SETTLE_TIMEOUT)
+            return await self.scales.measure_async()
+
+    async def _learn_flow(self, component, pour, start_weight):
+        try:
+            self._glass_weight = await self._settle()
+        except (WaitingForWeightAbortedException, asyncio.CancelledError):
+            raise
+        except ScalesException:
+            logger.exception('Could not measure the settled weight of %s', component.name)
+            return None
+
+        used_weight = self._glass_weight - start_weight
+        pour.finish(used_weight)
+        self._invalidate_plans([component])
+        logger.info('%s overshoot %f gr, flow model: %s',
+                    component.name, used_weight - pour.target, self.flow_models[component.name])
+        try:
+            self.flow_models.save()
+        except OSError:
+            logger.exception('Could not save the flow models')
+        return used_weight
+
+    @sm_transition(allowed_from=BartenderState.MAKING, while_working=BartenderState.POURING,
+                   when_done=BartenderState.MAKING, on_exception=BartenderState.ABORTED)
+    async def _pour_parallel(self, recipe: Recipe, components: Dict[Component, int], step: PourStep):
+        def close(component):
+            logger.info('%s reached its target', component.name)
+            self._close_valve(component, reacting=True)
+
+        pours = OrderedDict((c, (self.flow_models[c.name], volume * c.density)) for c, volume in components.items())
+        pour = ParallelPourTracker(pours, close)
+        start_weight = self._glass_weight
+
+        def on_progress(done, target):
+            if self._sm_state != BartenderState.POURING:
+                return
+            for c, volume in components.items():
+                self._pour_progress(recipe=recipe, component=c,
+                                    done=min(pour.poured[c], pours[c][1]), volume=pours[c][1])
 
-            used_volume = pouring_tracker.value + MEASURING_INERTIA
-            logger.info('Used: %f ml of %s', used_volume, component)
+        poured = False
+        used_weights = None
+        try:
+            for component in components:
+                self.components[component].open()
+
+            await self.scales.wait_for_weight_async(
+                start_weight + step.weight,
+                timeout=step.timeout,
+                until=lambda weight, timestamp: pour.observe(weight - start_weight, timestamp),
+                on_progress=on_progress
+            )
+            poured = True
+            for component in components:
+                self.components[component].close()
+
+            try:
+                self._glass_weight = await self._settle()
+                used_weights = pour.finish(self._glass_weight - start_weight)
+                self._invalidate_plans(components)
+            except (WaitingForWeightAbortedException, asyncio.CancelledError):
+                raise  # aborting the drink
+            except ScalesException:
+                logger.exception('Could not measure the settled weight')
+
+        except ScalesTimeoutException as e:
+            logger.exception('Target weights are not reached within timeout. '
+                             'Is something wrong with the valves?')
+            raise CocktailAbortedException from e
+        except WaitingForWeightAbortedException as e:
+            logger.info('Cocktail making aborted')
+            raise CocktailAbortedException from e
+        finally:
+            if not poured:
+                for component in components:
+                    self.components[component].close()
+
+            for component, used_weight in (used_weights or pour.poured).items():
+                logger.info('Used: %f ml of %s', used_weight / component.density, component)
 
     @sm_transition(allowed_from=BartenderState.POURING, while_working=BartenderState.POURING_PROGRESS,
                    when_done=BartenderState.POURING)
     def _pour_progress(self, recipe, component, done, volume):
         pass
 
+    def serve(self):
+        """Waits for the glass lift on the engine, blocking the calling thread"""
+        return self.engine.run(self.serve_async())
+
     @sm_transition(allowed_from=BartenderState.READY, when_done=BartenderState.IDLE,
                    on_exception=BartenderState.ABORTED)
-    def serve(self):
-        return self._wait_for_glass_lift()
+    async def serve_async(self):
+        return await self._wait_for_glass_lift()
 
     @sm_transition(allowed_from=BartenderState.ABORTED, when_done=BartenderState.IDLE)
     def discard(self):
-        self._abort = False
+        pass
 
     def abort(self):
-        self._abort = True
+        """Cancels the pour or the serve in progress, taking effect immediately"""
+        self.engine.cancel()
         self.scales.abort_waiting_for_weight()
         return True
 
-    def _wait_for_glass_lift(self):
+    async def _wait_for_glass_lift(self):
         logger.info('waiting for the user to retrieve the glass')
         try:
-            self.scales.reset()
-            self.scales.wait_for_weight(GLASS_WEIGHT * -1, USER_TAKE_GLASS_TIMEOUT)
+            await self.scales.reset_async()
+            await self.scales.wait_for_weight_async(GLASS_WEIGHT * -1, USER_TAKE_GLASS_TIMEOUT)
             logger.info('weight lifted')
             return True
         except ScalesTimeoutException as e:
@@ -0,0 +1,219 @@
+"""Drink latency, throughput and accuracy of the real make_drink/serve path, against the simulated scales.
+
+Every menu recipe is made and served a few times in a row. The bartender's transitions split
+each drink into phases: the scales reset and stabilize, every pour with its settle, the finish
+(the gaps between the pours and closing the compressor) and the glass lift wait. The times are in the clock the bartender runs on,
+i.e. the simulated seconds on a VirtualClock, the CPU cost of the whole drink is the wall time.
+The results are json, to compare the controller and config changes against a baseline."""
+import json
+import logging
+import math
+from collections import OrderedDict
+from time import perf_counter
+from typing import Dict, Iterable, List
+
+import attr
+
+from mixorama import util
+from mixorama.bartender import Bartender, BartenderState, CocktailAbortedException
+from mixorama.io import Valve
+from mixorama.recipes import Component, Recipe
+from mixorama.simulator import Simulator
+
+logger = logging.getLogger(__name__)
+
+BENCH_RUNS = 5  # drinks per recipe
+PHASE_RESET = 'reset'
+PHASE_FINISH = 'finish'
+PHASE_SERVE = 'serve'
+
+
+@attr.s
+class DrinkRun:
+    recipe = attr.ib()
+    ''':type: str'''
+    ok = attr.ib(default=False)
+    phases = attr.ib(default=attr.Factory(OrderedDict))
+    ''':type: Dict[str, float], sec by phase, the pours are named after their components'''
+    wall = attr.ib(default=0.0)
+    ''':type: float, sec the drink took for real'''
+    volume_errors = attr.ib(default=attr.Factory(dict))
+    ''':type: Dict[str, float], ml poured over the recipe's by component'''
+    weight_error = attr.ib(default=0.0)
+    ''':type: float, gr in the glass over the recipe's'''
+
+    @property
+    def duration(self):
+        return sum(self.phases.values())
+
+
+class PhaseRecorder:
+    """Timestamps the bartender's transitions into the phases of a drink"""
+
+    def __init__(self, bartender: Bartender):
+        self.marks = []
+        ''':type: List[Tuple[str, float]], (phase starting, timestamp), the None phase ends the drink'''
+        bartender.on_sm_transitions({
+            BartenderState.POURING: self._on_pouring,
+            BartenderState.MAKING: self._on_making,
+            BartenderState.READY: self._on_ready,
+        })
+
+    def start(self):
+        self.marks = [(PHASE_RESET, util.now())]
+
+    def _on_pouring(self, fromstate, component=None, components=None):
+        if fromstate == BartenderState.MAKING:
+            name = component.name if component else '+'.join(sorted(c.name for c in components))
+            self.marks.append((name, util.now()))
+
+    def _on_making(self, fromstate):
+        if fromstate != BartenderState.IDLE:  # between the pours, then closing the compressor
+            self.marks.append((PHASE_FINISH, util.now()))
+
+    def _on_ready(self):
+        self.marks.append((None, util.now()))
+
+    def phases(self) -> Dict[str, float]:
+        phases = OrderedDict()
+        for (phase, start), (_, end) in zip(self.marks, self.marks[1:]):
+            if phase is not None:
+                phases[phase] = phases.get(phase, 0.0) + end - start
+        return phases
+
+
+def bench_bar(bar: Dict[Component, Valve], recipes: Iterable[Recipe]):
+    """Full copies of the bar's bottles and the recipes pouring from them: the bench never runs dry,
+    nor touches the real levels and their inventory"""
+    copies = {c: Component(c.name, c.density, c.strength, c.volume) for c in bar}
+    return {copies[c]: valve for c, valve in bar.items()}, \
+        [Recipe(r.name, [(copies[c], volume) for c, volume in r], r.meta) for r in recipes]
+
+
+def run_drink(bartender: Bartender, simulator: Simulator, recorder: PhaseRecorder, recipe: Recipe) -> DrinkRun:
+    run = DrinkRun(recipe.name)
+    poured = {c: simulator.poured[c] for c, _ in recipe}
+
+    started = perf_counter()
+    recorder.start()
+    try:
+        bartender.make_drink(recipe)
+        content = simulator.content
+        phases = recorder.phases()
+
+        serving = util.now()
+        bartender.serve()
+        phases[PHASE_SERVE] = util.now() - serving
+    except CocktailAbortedException:
+        logger.exception('%s aborted', recipe.name)
+        bartender.discard()
+        return run
+    finally:
+        run.wall = perf_counter() - started
+
+    run.ok = True
+    run.phases = phases
+    run.volume_errors = {c.name: simulator.poured[c] - poured[c] - volume for c, volume in recipe}
+    run.weight_error = content - recipe.weight()
+    return run
+
+
+def _percentile(values: List[float], p) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(p / 100 * len(values))) - 1)] if values else 0.0
+
+
+def _summary(values: Iterable[float]) -> Dict[str, float]:
+    values = list(values)
+    if not values:
+        return {}
+    return OrderedDict([('mean', sum(values) / len(values)), ('p50', _percentile(values, 50)),
+                        ('p95', _percentile(values, 95)), ('max', max(values))])
+
+
+def summarize(runs: List[DrinkRun]) -> Dict[str, object]:
+    done = [r for r in runs if r.ok]
+    phases = OrderedDict()
+    for run in done:
+        for phase, duration in run.phases.items():
+            phases.setdefault(phase, []).append(duration)
+    durations = [r.duration for r in done]
+    volume_errors = [abs(e) for r in done for e in r.volume_errors.values()]
+
+    return OrderedDict([
+        ('runs', len(runs)),
+        ('aborted', len(runs) - len(done)),
+        ('drink_time', _summary(durations)),
+        ('drinks_per_hour', 3600 * len(done) / sum(durations) if sum(durations) else 0.0),
+        ('wall_time', _summary(r.wall for r in done)),
+        ('phases', OrderedDict((phase, _summary(values)) for phase, values in phases.items())),
+        ('volume_error', _summary(volume_errors)),
+        ('weight_error', _summary(r.weight_error for r in done)),
+        ('abs_weight_error', _summary(abs(r.weight_error) for r in done)),
+    ])
+
+
+def run_bench(bartender: Bartender, recipes: Iterable[Recipe], runs=BENCH_RUNS) -> Dict[str, object]:
+    """:param recipes: pouring from the bartender's components, see bench_bar()"""
+    simulator = bartender.scales.scales
+    if not isinstance(simulator, Simulator):
+        raise ValueError('The bench needs the simulated scales, see the bartender simulator config')
+
+    recipes = list(recipes)
+    bartender.compile_plans(recipes)
+    recorder = PhaseRecorder(bartender)
+
+    all_runs = []
+    results = OrderedDict()
+    for recipe in recipes:
+        recipe_runs = [run_drink(bartender, simulator, recorder, recipe) for _ in range(runs)]
+        all_runs.extend(recipe_runs)
+        results[recipe.name] = summarize(recipe_runs)
+        logger.info('%s: %.1f sec per drink, %.1f gr off', recipe.name,
+                    results[recipe.name]['drink_time'].get('mean', 0),
+                    results[recipe.name]['abs_weight_error'].get('mean', 0))
+
+    return OrderedDict([('runs_per_recipe', runs), ('total', summarize(all_runs)), ('recipes', results)])
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+COMPARED = [  # (path in the summary, lower is better)
+    (('drink_time', 'mean'), True),
+    (('drinks_per_hour',), False),
+    (('wall_time', 'mean'), True),
+    (('abs_weight_error', 'mean'), True),
+    (('volume_error', 'mean'), True),
+    (('aborted',), True),
+]
+
+
+def _lookup(summary, path):
+    for key in path:
+        summary = summary.get(key, {}) if isinstance(summary, dict) else {}
+    return summary if isinstance(summary, (int, float)) else None
+
+
+def compare(results, baseline) -> List[tuple]:
+    """(recipe, metric, baseline, current, change in %, better) for the metrics and recipes in both"""
+    rows = []
+    pairs = [('total', results['total'], baseline.get('total', {}))]
+    pairs += [(name, summary, baseline.get('recipes', {}).get(name, {}))
+              for name, summary in results['recipes'].items()]
+    for name, summary, base in pairs:
+        for path, lower_is_better in COMPARED:
+            current, before = _lookup(summary, path), _lookup(base, path)
+            if current is None or before is None:
+                continue
+            change = (current - before) / abs(before) * 100 if before else 0.0
+            better = current < before if lower_is_better else current > before
+            rows.append((name, '.'.join(path), before, current, change, better and current != before))
+    return rows
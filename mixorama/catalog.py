@@ -0,0 +1,271 @@
+"""A catalog of recipes beyond the menu, e.g. imported from docs/wiki/cocktails_w_info.json.
+
+Every distinct ingredient gets a bit, every recipe the mask of its ingredients' bits, so the recipes
+a bar can make are the ones whose mask has no bits outside the bar's mask."""
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import attr
+
+from mixorama.recipes import Component, Recipe
+
+logger = logging.getLogger(__name__)
+
+PART_VOLUME = 30  # ml, when an ingredient is given in parts
+DRINK_VOLUME = 120  # ml, when an ingredient is given as a fraction of the drink
+
+UNITS = OrderedDict([  # ml per unit, the longer names first so the regex prefers them
+    ('tablespoons', 15), ('tablespoon', 15), ('tbsp', 15),
+    ('teaspoons', 5), ('teaspoon', 5), ('tsp', 5),
+    ('ounces', 29.57), ('ounce', 29.57), ('oz', 29.57),
+    ('dashes', 1), ('dash', 1),
+    ('cups', 240), ('cup', 240),
+    ('part(s)', PART_VOLUME), ('parts', PART_VOLUME), ('part', PART_VOLUME),
+    ('cl', 10), ('ml', 1),
+])
+
+NUMBER_WORDS = {'a': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'half': .5}
+VULGAR_FRACTIONS = {'½': 1 / 2, '⅓': 1 / 3, '⅔': 2 / 3, '¼': 1 / 4, '¾': 3 / 4, '⅕': 1 / 5, '⅖': 2 / 5, '⅗': 3 / 5,
+                    '⅘': 4 / 5, '⅙': 1 / 6, '⅚': 5 / 6, '⅛': 1 / 8, '⅜': 3 / 8, '⅝': 5 / 8, '⅞': 7 / 8}
+
+NOT_POURABLE = {'ice', 'sugar', 'sugar cubes', 'mint', 'mint leaves', 'nutmeg', 'cinnamon'}
+
+ALIASES = {
+    'white rum': 'rum', 'light rum': 'rum', 'gold rum': 'rum',
+    'black rum': 'dark rum',
+    'malibu': 'malibu rum',
+    'gomme syrup': 'simple syrup', 'sugar syrup': 'simple syrup',
+    'grenadine': 'grenadine syrup',
+    'tonic': 'tonic water',
+    'cola': 'coca-cola', 'coke': 'coca-cola',
+    'cranberry': 'cranberry juice',
+    'midori': 'midori melon liqueur',
+}
+
+_number = r'(?:\d+\s+\d+\s*[/⁄]\s*\d+|\d*[{v}]|\d+(?:[.,]\d+)?(?:\s*[/⁄]\s*\d+)?|(?:{w})\b)'.format(
+    v=''.join(VULGAR_FRACTIONS), w='|'.join(NUMBER_WORDS))  # 1 1/2, 1½, 4.5, 1/6 or two
+_unit = '|'.join(re.escape(u) for u in UNITS)
+INGREDIENT_RE = re.compile(
+    r'^(?P<qty>{n})(?:\s*(?:-|or|to)\s*{n})?\s*(?P<unit>{u})?\.?(?![a-z])\s*(?:of\s+)?(?P<name>.+)$'.format(
+        n=_number, u=_unit),
+    re.IGNORECASE)
+IMPLICIT_DASH_RE = re.compile(r'^dash(?:es)?\s+(?:of\s+)?(?P<name>.+)$', re.IGNORECASE)
+FRACTION_RE = re.compile(r'^(?:(?P<whole>\d+)\s+)?(?P<numerator>\d+)\s*/\s*(?P<denominator>\d+)$')
+ALTERNATE_QTY_RE = re.compile(r'^/\s*{n}\s*(?:{u})\.?\s*'.format(n=_number, u=_unit), re.IGNORECASE)
+
+
+def normalize_name(name: str, aliases: Dict[str, str] = None) -> str:
+    """'Fresh lemon juice (or lime)' -> 'lemon juice', then aliased to the canonical name"""
+    aliases = ALIASES if aliases is None else aliases
+    name = re.sub(r'\(.*?\)|\[.*?\]', '', name.replace('​', ''))
+    name = ALTERNATE_QTY_RE.sub('', name.strip())
+    name = re.split(r',| or ', name)[0]
+    name = re.sub(r'^(?:fresh|freshly squeezed)\s+', '', name.strip(), flags=re.IGNORECASE)
+    name = re.sub(r'\s+', ' ', name).strip(' .').lower()
+    return aliases.get(name, name)
+
+
+def _parse_number(text: str) -> float:
+    text = text.lower().replace(',', '.').replace('⁄', '/').strip()
+    if text in NUMBER_WORDS:
+        return NUMBER_WORDS[text]
+    if text[-1:] in VULGAR_FRACTIONS:  # 1½
+        return float(text[:-1] or 0) + VULGAR_FRACTIONS[text[-1]]
+    match = FRACTION_RE.match(text)
+    if match:  # 1 1/2
+        return int(match.group('whole') or 0) + int(match.group('numerator')) / int(match.group('denominator'))
+    return float(text)
+
+
+def parse_ingredient(line: str, aliases: Dict[str, str] = None) -> Optional[Tuple[str, float]]:
+    """'4.5 cl white rum' -> ('rum', 45.0), None for the unmeasured ones like 'Top with Prosecco'"""
+    line = line.replace('​', '').strip()
+
+    match = IMPLICIT_DASH_RE.match(line)
+    if match:
+        return normalize_name(match.group('name'), aliases), UNITS['dash']
+
+    match = INGREDIENT_RE.match(line)
+    if not match:
+        return None
+
+    qty, unit = match.group('qty'), match.group('unit')
+    name = normalize_name(match.group('name'), aliases)
+    if name in NOT_POURABLE:
+        return None
+
+    amount = _parse_number(qty)
+    if unit:
+        return name, amount * UNITS[unit.lower()]
+    if amount < 1:  # 1/6 rum
+        return name, amount * DRINK_VOLUME
+    return None  # counted, not measured: 2 sugar cubes
+
+
+def is_unmeasured(line: str, aliases: Dict[str, str] = None) -> bool:
+    """An ingredient poured without a quantity, like 'Top with Prosecco', unlike the counted or garnish ones
+    like '6 sprigs of mint', see parse_ingredient()"""
+    line = line.replace('​', '').strip()
+    if not line or INGREDIENT_RE.match(line):
+        return False
+    name = normalize_name(re.sub(r'^top(?:\s+up)?\s+with\s+', '', line, flags=re.IGNORECASE), aliases)
+    return name not in NOT_POURABLE
+
+
+@attr.s
+class CatalogRecipe:
+    name = attr.ib()
+    ''':type: str'''
+    sequence = attr.ib()
+    ''':type: List[Tuple[str, int]], (ingredient, ml)'''
+    extras = attr.ib(default=attr.Factory(list))
+    ''':type: List[str], the garnish and the unmeasured ingredients, not poured'''
+    meta = attr.ib(default=attr.Factory(dict))
+    ''':type: Dict[str, str], url, description'''
+    mask = attr.ib(default=0)
+    ''':type: int, the bits of the ingredients'''
+
+    def to_dict(self):
+        return attr.asdict(self)
+
+
+class Catalog:
+    def __init__(self, path=None, aliases: Dict[str, str] = None):
+        self.path = path
+        self.aliases = ALIASES if aliases is None else aliases
+        self.recipes = []
+        ''':type: List[CatalogRecipe]'''
+        self.ingredients = []
+        ''':type: List[str], ingredient by bit'''
+        self._bits = {}
+        ''':type: Dict[str, int], bit by ingredient'''
+        self._by_mask = OrderedDict()
+        ''':type: Dict[int, List[CatalogRecipe]]'''
+        self._by_name = {}
+        ''':type: Dict[str, CatalogRecipe]'''
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        catalog = cls(path, **kwargs)
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                catalog.ingredients = data['ingredients']
+                catalog._bits = {name: bit for bit, name in enumerate(catalog.ingredients)}
+                for recipe in data['recipes']:
+                    recipe['sequence'] = [tuple(i) for i in recipe['sequence']]
+                    catalog._index(CatalogRecipe(**recipe))
+            except (ValueError, KeyError, TypeError):
+                logger.exception('Could not load the catalog from %s', path)
+        return catalog
+
+    def save(self):
+        if not self.path:
+            return
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(ingredients=self.ingredients, recipes=[r.to_dict() for r in self.recipes]), f)
+        os.replace(tmp_path, self.path)
+
+    def add(self, name, sequence: Iterable[Tuple[str, int]], extras=(), **meta) -> CatalogRecipe:
+        sequence = [(ingredient, volume) for ingredient, volume in sequence]
+        recipe = CatalogRecipe(name, sequence, list(extras), meta, self.mask(i for i, _ in sequence))
+        self.remove(name)
+        self._index(recipe)
+        return recipe
+
+    def remove(self, name):
+        recipe = self._by_name.pop(name, None)
+        if recipe is not None:
+            self.recipes.remove(recipe)
+            self._by_mask[recipe.mask].remove(recipe)
+
+    def _index(self, recipe: CatalogRecipe):
+        self.recipes.append(recipe)
+        self._by_name[recipe.name] = recipe
+        self._by_mask.setdefault(recipe.mask, []).append(recipe)
+
+    def bit(self, ingredient: str) -> int:
+        if ingredient not in self._bits:
+            self._bits[ingredient] = len(self.ingredients)
+            self.ingredients.append(ingredient)
+        return self._bits[ingredient]
+
+    def mask(self, ingredients: Iterable[str]) -> int:
+        """The mask of the ingredients, the new ones get their bits"""
+        mask = 0
+        for ingredient in ingredients:
+            mask |= 1 << self.bit(ingredient)
+        return mask
+
+    def bar_mask(self, components: Iterable[Component]) -> int:
+        """The mask of the catalog ingredients among the components, the others don't matter"""
+        mask = 0
+        for component in components:
+            bit = self._bits.get(normalize_name(component.name, self.aliases))
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def makeable(self, components: Iterable[Component]) -> List[CatalogRecipe]:
+        """The recipes that can be poured from the components alone"""
+        missing = ~self.bar_mask(components)
+        return [r for mask, recipes in self._by_mask.items() if not mask & missing for r in recipes]
+
+    def to_recipe(self, recipe: CatalogRecipe, components: Iterable[Component]) -> Recipe:
+        by_ingredient = {normalize_name(c.name, self.aliases): c for c in components}
+        return Recipe(recipe.name, [(by_ingredient[i], v) for i, v in recipe.sequence], recipe.meta)
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def __iter__(self):
+        return iter(self.recipes)
+
+
+def _infobox(cocktail):
+    return {re.sub(r'\s+', ' ', i['infobox_key']): i['infobox_value'] for i in cocktail.get('selection2', [])}
+
+
+def import_wikipedia(path, catalog: Catalog) -> Catalog:
+    """Adds the cocktails from the scraped wikipedia infoboxes, see docs/wiki/cocktails_w_info.json"""
+    with open(path) as f:
+        cocktails = json.load(f)
+
+    for cocktail in cocktails:
+        infobox = _infobox(cocktail)
+        ingredients = infobox.get('IBA specified ingredients')
+        if not ingredients:
+            continue
+
+        name = re.sub(r'\s*\(cocktail\)$', '', cocktail['name'])
+        sequence = OrderedDict()
+        extras = []
+        unmeasured = []
+        for line in ingredients.splitlines():
+            parsed = parse_ingredient(line, catalog.aliases)
+            if parsed is None:
+                if is_unmeasured(line, catalog.aliases):
+                    unmeasured.append(line.strip())
+                extras.append(line.strip())
+                continue
+            ingredient, volume = parsed
+            sequence[ingredient] = sequence.get(ingredient, 0) + max(int(round(volume)), 1)
+
+        if not sequence or unmeasured:
+            # the bar could not pour it whole, the unmeasured ingredients would not count against its mask
+            logger.warning('Skipping %s, %s', cocktail['name'], 'its ingredients are not measured' if not sequence
+                           else 'the quantity is missing: {}'.format(', '.join(unmeasured)))
+            catalog.remove(name)
+            continue
+
+        meta = dict(url=cocktail.get('url'), description=infobox.get('Preparation'))
+        catalog.add(name, sequence.items(), extras, **meta)
+
+    return catalog
@@ -0,0 +1,56 @@
+"""An asyncio event loop running the Bartender's coroutines on a single thread."""
+import asyncio
+import logging
+from concurrent.futures import Future
+from threading import Thread
+
+logger = logging.getLogger(__name__)
+
+
+class Engine:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._tasks = set()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run_loop, name='bartender-engine', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        logger.debug('started the bartender engine')
+        self.loop.run_forever()
+
+    def run(self, coro):
+        """Runs the coroutine on the engine, blocking the calling thread until it's done"""
+        return self.submit(coro).result()
+
+    def submit(self, coro) -> Future:
+        """Queues the coroutine on the engine, returning immediately"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self._track(coro), self.loop)
+
+    async def _track(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        try:
+            return await task
+        finally:
+            self._tasks.discard(task)
+
+    def cancel(self):
+        """Cancels whatever the engine is running, from any thread"""
+        def cancel_tasks():
+            for task in self._tasks:
+                task.cancel()
+
+        if self._thread is not None:
+            self.loop.call_soon_threadsafe(cancel_tasks)
@@ -4,11 +4,18 @@ from collections import OrderedDict
 from typing import Dict
 
 from mixorama.bartender import Bartender
+from mixorama.catalog import Catalog
+from mixorama.flow import FlowModels
+from mixorama.inventory import Inventory
 from mixorama.io import Valve, io_init
+from mixorama.metrics import METRICS_HOST, MetricsExporter, TEXTFILE_INTERVAL
+from mixorama.orders import OrderQueue
 from mixorama.recipes import Component, Recipe
 from mixorama.scales import Scales
-from mixorama.usage import UsageManager, configure_db
-from mixorama.util import DefaultFactoryDict
+from mixorama.usage import UsageManager, UsageWriter, configure_db
+from mixorama.simulator import Simulator, SimulatedValve
+from mixorama.tracing import Tracer
+from mixorama.util import DefaultFactoryDict, VirtualClock, set_clock
 
 logger = logging.getLogger(__name__)
 
@@ -18,42 +25,98 @@ class ComponentNotAvailable(Exception):
 
 
 def create_bartender(bar, config):
-    logger.debug('Initializing scales')
-    scales = Scales(**config.get('scales', dict(port='/dev/ttyACM0', baudrate=115200)))
+    simulated = config.get('simulator') is not None
 
     logger.debug('Initializing compressor')
-    compressor = Valve(config.get('compressor', 26))  # 37
+    if simulated:  # the simulated scales would never stop a real pour
+        bar = {component: SimulatedValve(valve.channel) for component, valve in bar.items()}
+        compressor = SimulatedValve(config.get('compressor', 26))
+    else:
+        compressor = Valve(config.get('compressor', 26))  # 37
+
+    logger.debug('Initializing scales')
+    scales_config = config.get('scales', dict(port='/dev/ttyACM0', baudrate=115200))
+    if simulated:
+        scales_config = dict(scales_config, impl=create_simulator(bar, compressor, scales_config, config['simulator']))
+    scales = Scales(**scales_config)
+
+    logger.debug('Loading flow models')
+    flow_models = FlowModels.load(config.get('flow_models', 'flow_models.json'))
 
     logger.debug('Waking up the bartender')
-    bartender = Bartender(bar, compressor, scales)
+    bartender = Bartender(bar, compressor, scales, flow_models, config.get('parallel_pour', False),
+                          dense_first=config.get('dense_first', False))
 
     return bartender
 
 
+def create_simulator(bar, compressor, scales_config, config):
+    logger.warning('Simulating the scales on a virtual clock!')
+    config = dict(config or {})
+    if config.pop('virtual_clock', True):
+        set_clock(VirtualClock())
+    return Simulator(bar, compressor, calibrated_1g=scales_config.get('calibrated_1g', -2000.0), **config)
+
+
+def create_order_queue(bartender):
+    logger.debug('Opening the order queue')
+    orders = OrderQueue(bartender)
+    orders.start()
+    return orders
+
+
 def create_usage_manager(bartender, config):
     assert isinstance(config, dict)
     logger.debug('Connecting to usage db')
     db_url = config.get('db_url', 'sqlite:///usage.sqlite3')
-    assert configure_db(db_url), 'can connect to usage db'
-    usage_manager = UsageManager(bartender)
+    configure_db(db_url)
+    usage_manager = UsageManager(bartender, UsageWriter().start())
     return usage_manager
 
 
-def create_shelf(config):
-    shelf = DefaultFactoryDict(lambda n: Component(name=n))
+def create_tracer(bartender):
+    logger.debug('Tracing the drinks')
+    return Tracer(bartender)
+
+
+def create_metrics_exporter(config, tracer: Tracer = None):
+    config = config or {}
+    exporter = MetricsExporter(port=config.get('port'), host=config.get('host', METRICS_HOST),
+                               textfile=config.get('textfile'), interval=config.get('interval', TEXTFILE_INTERVAL),
+                               traces=tracer.latest if tracer else None)
+    try:
+        return exporter.start()
+    except OSError:
+        logger.exception('Could not export the metrics')
+        return exporter
+
+
+def create_inventory(config):
+    config = config or {}
+    logger.debug('Restoring the inventory')
+    return Inventory.load(config.get('path', 'inventory'),
+                          snapshot_interval=config.get('snapshot_interval', 100))
+
+
+def create_shelf(config, inventory: Inventory = None):
+    inventory = inventory or Inventory()
+    shelf = DefaultFactoryDict(lambda n: inventory.restore(Component(name=n)))
     for name, properties in config.items():
-        shelf[name] = Component(name=name, **properties)
+        shelf[name] = inventory.restore(Component(name=name, **properties))
     return shelf
 
 
-def create_bar(shelf, config):
+def create_bar(shelf, config, inventory: Inventory = None):
     logger.debug('Initializing GPIO')
     io_init()
 
     logger.debug('Initializing components')
     bar = {}
     for component_name, pin in config.items():
-        bar[shelf[component_name]] = Valve(pin)
+        component = shelf[component_name]
+        if inventory:
+            inventory.restore(component)
+        bar[component] = Valve(pin)
     return bar
 
 
@@ -62,7 +125,7 @@ def create_menu(bar, config: Dict[str, Dict[str, int]]):
     available_components = dict([(c.name, c) for c in bar.keys()])
     for recipe_name, sequence in config.items():
         meta = sequence.pop('meta') if 'meta' in sequence else {}
-        meta['name'] = meta.get('name', recipe_name)
+        name = meta.pop('name', recipe_name)
 
         try:
             component_sequence = []
@@ -72,8 +135,13 @@ def create_menu(bar, config: Dict[str, Dict[str, int]]):
 
                 component_sequence.append((available_components[component_name], volume))
 
-            recipes[recipe_name] = Recipe(sequence=component_sequence, **meta)
+            recipes[recipe_name] = Recipe(name, component_sequence, meta)
         except ComponentNotAvailable as e:
             logger.warning('Cannot add {} to the menu, as it is not in the bar'.format(e.args[0]))
 
     return recipes
+
+
+def create_catalog(config):
+    config = config or {}
+    return Catalog.load(config.get('path', 'catalog.json'))
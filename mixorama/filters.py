@@ -0,0 +1,168 @@
+"""Incremental filters of the raw load-cell samples, applied by the scales reader to every sample it receives.
+All the values are in the raw units of the scales, before tare and calibration."""
+import logging
+import statistics
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    logger.info('numpy is not available, window filters will use the statistics module')
+    numpy = None
+
+
+class SampleFilter:
+    """Passes the samples through as they are"""
+    velocity = None
+    ''':type: float, raw units/sec, if the filter estimates it'''
+
+    def update(self, value, timestamp):
+        return value
+
+    def reset(self):
+        pass
+
+
+class _Window:
+    """A fixed-size ring of the latest values, numpy-backed when numpy is available"""
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self._index = 0
+        self._values = numpy.zeros(size) if numpy is not None else [0.0] * size
+
+    def append(self, value):
+        self._values[self._index] = value
+        self._index = (self._index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def values(self):
+        return self._values[:self.count]
+
+    def median(self):
+        if numpy is not None:
+            return float(numpy.median(self.values()))
+        return statistics.median(self.values())
+
+    def mean_stdev(self):
+        if numpy is not None:
+            values = self.values()
+            return float(values.mean()), float(values.std(ddof=1))
+        values = self.values()
+        return statistics.mean(values), statistics.stdev(values)
+
+    def clear(self):
+        self.count = self._index = 0
+
+
+class MedianFilter(SampleFilter):
+    """A moving median, removing spikes at the cost of a delay of half the window"""
+
+    def __init__(self, window=5):
+        self.window = _Window(window)
+
+    def update(self, value, timestamp):
+        self.window.append(value)
+        return self.window.median()
+
+    def reset(self):
+        self.window.clear()
+
+
+class OutlierRejectFilter(SampleFilter):
+    """Replaces the samples too far from the recent ones with the window median"""
+
+    def __init__(self, window=10, stdev_multiplier=2):
+        self.window = _Window(window)
+        self.stdev_multiplier = stdev_multiplier
+
+    def update(self, value, timestamp):
+        if self.window.count > 2:
+            mean, stdev = self.window.mean_stdev()
+            is_outlier = abs(value - mean) > self.stdev_multiplier * stdev
+        else:
+            is_outlier = False
+
+        # outliers still get into the window, so a real step change gets through after a few samples
+        self.window.append(value)
+        return self.window.median() if is_outlier else value
+
+    def reset(self):
+        self.window.clear()
+
+
+class EmaFilter(SampleFilter):
+    """An exponential moving average"""
+
+    def __init__(self, alpha=0.5):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, value, timestamp):
+        self.value = value if self.value is None else self.value + self.alpha * (value - self.value)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class KalmanFilter(SampleFilter):
+    """A 1-D constant velocity Kalman filter, estimating the weight and its rate of change"""
+
+    def __init__(self, measurement_noise=1e4, process_noise=1e6):
+        """
+        :param measurement_noise: variance of the samples, raw units^2
+        :param process_noise: variance of the weight acceleration, (raw units/sec^2)^2
+        """
+        self.r = measurement_noise
+        self.q = process_noise
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.velocity = 0.0
+        self.timestamp = None
+        self._p = [[self.r, 0.0], [0.0, self.q]]
+
+    def update(self, value, timestamp):
+        if self.value is None:
+            self.value, self.timestamp = value, timestamp
+            return value
+
+        dt = max(timestamp - self.timestamp, 0)
+        self.timestamp = timestamp
+        (p00, p01), (p10, p11) = self._p
+
+        # predict
+        self.value += self.velocity * dt
+        p00 += dt * (p10 + p01) + dt * dt * p11 + self.q * dt ** 4 / 4
+        p01 += dt * p11 + self.q * dt ** 3 / 2
+        p10 += dt * p11 + self.q * dt ** 3 / 2
+        p11 += self.q * dt * dt
+
+        # correct
+        s = p00 + self.r
+        k0, k1 = p00 / s, p10 / s
+        innovation = value - self.value
+        self.value += k0 * innovation
+        self.velocity += k1 * innovation
+        self._p = [[(1 - k0) * p00, (1 - k0) * p01],
+                   [p10 - k1 * p00, p11 - k1 * p01]]
+        return self.value
+
+
+FILTERS = {
+    'none': SampleFilter,
+    'median': MedianFilter,
+    'outliers': OutlierRejectFilter,
+    'ema': EmaFilter,
+    'kalman': KalmanFilter,
+}
+
+
+def create_filter(type='none', **params) -> SampleFilter:
+    if type not in FILTERS:
+        raise ValueError('Unknown scales filter {}, use one of {}'.format(type, ', '.join(FILTERS)))
+    return FILTERS[type](**params)
@@ -0,0 +1,217 @@
+"""Per-component flow models, learning how fast a component pours and how much of it
+is still on its way into the glass when the valve closes."""
+import json
+import logging
+import os
+from collections import deque
+from typing import Dict, Tuple
+
+from mixorama.util import DefaultFactoryDict
+
+DEFAULT_FLOW_RATE = 10  # gr/sec, until the first pour of a component is observed
+DEFAULT_INERTIA = 10  # grams, that the scales don't see when the valve closes
+LEARNING_RATE = 0.3  # weight of the latest pour in the learned parameters
+FLOW_WINDOW = 5  # samples, to estimate the current flow rate from
+MIN_FLOW_RATE = 0.5  # gr/sec, slower pours don't teach us anything about the flow
+SETTLED_FLOW_RATE = 0.5  # gr/sec, the glass is considered settled below that
+POUR_TIMEOUT_FACTOR = 3  # times the expected pour duration
+POUR_TIMEOUT_MARGIN = 3000  # ms
+
+logger = logging.getLogger(__name__)
+
+
+class FlowModel:
+    def __init__(self, flow_rate=None, lag=None, pours=0):
+        """
+        :param flow_rate: gr/sec, learned from the recent pours
+        :param lag: sec, for how long the current flow keeps reaching the glass after the cutoff
+        :param pours: number of pours the model has learned from
+        """
+        self.flow_rate = DEFAULT_FLOW_RATE if flow_rate is None else flow_rate
+        self.lag = DEFAULT_INERTIA / DEFAULT_FLOW_RATE if lag is None else lag
+        self.pours = pours
+
+    def overshoot(self, flow_rate=None):
+        """Grams that will still arrive into the glass if the valve is closed now"""
+        return max(self.flow_rate if flow_rate is None else flow_rate, 0) * self.lag
+
+    def timeout(self, target):
+        """ms to wait for a target weight, or None if we know nothing about the component yet"""
+        if not self.pours:
+            return None
+        return target / self.flow_rate * 1000 * POUR_TIMEOUT_FACTOR + POUR_TIMEOUT_MARGIN
+
+    def pour(self, target):
+        return PourTracker(self, target)
+
+    def learn(self, flow_rate, cutoff_flow_rate, overshoot):
+        if flow_rate < MIN_FLOW_RATE or cutoff_flow_rate < MIN_FLOW_RATE:
+            logger.debug('flow is too slow to learn from: %f gr/sec', flow_rate)
+            return
+
+        lag = max(overshoot, 0) / cutoff_flow_rate
+        if self.pours:
+            self.flow_rate += LEARNING_RATE * (flow_rate - self.flow_rate)
+            self.lag += LEARNING_RATE * (lag - self.lag)
+        else:
+            self.flow_rate, self.lag = flow_rate, lag
+        self.pours += 1
+
+    def to_dict(self):
+        return dict(flow_rate=self.flow_rate, lag=self.lag, pours=self.pours)
+
+    def __str__(self):
+        return '%.2f gr/sec, %.2f sec lag after %d pours' % (self.flow_rate, self.lag, self.pours)
+
+
+class PourTracker:
+    """Follows the samples of a single pour to predict the moment to close the valve"""
+
+    def __init__(self, model: FlowModel, target):
+        self.model = model
+        self.target = target
+        self.samples = deque(maxlen=FLOW_WINDOW)
+        self.started_at = None
+        self.cutoff_weight = 0
+        self.cutoff_flow_rate = None
+
+    def flow_rate(self):
+        if len(self.samples) < 2:
+            return None
+        (t0, w0), (t1, w1) = self.samples[0], self.samples[-1]
+        return (w1 - w0) / (t1 - t0) if t1 > t0 else None
+
+    def observe(self, weight, timestamp):
+        """Returns True when the valve should be closed"""
+        if self.started_at is None:
+            self.started_at = timestamp
+        self.samples.append((timestamp, weight))
+
+        flow_rate = self.flow_rate()
+        self.cutoff_weight = weight
+        self.cutoff_flow_rate = flow_rate
+        if flow_rate is None:  # not flowing long enough to predict anything
+            return weight >= self.target
+        return weight + self.model.overshoot(flow_rate) >= self.target
+
+    def finish(self, final_weight):
+        """Teaches the model with the weight settled after the valve was closed"""
+        if self.cutoff_flow_rate is None or self.started_at is None:
+            return
+
+        duration = self.samples[-1][0] - self.started_at
+        if duration <= 0:
+            return
+
+        self.model.learn(flow_rate=self.cutoff_weight / duration,
+                         cutoff_flow_rate=self.cutoff_flow_rate,
+                         overshoot=final_weight - self.cutoff_weight)
+
+
+class SettleTracker:
+    """Waits for the liquid in flight to land after the valves are closed"""
+
+    def __init__(self):
+        self.samples = deque(maxlen=FLOW_WINDOW)
+
+    def observe(self, weight, timestamp):
+        """Returns True when the weight has stopped growing"""
+        self.samples.append((timestamp, weight))
+        if len(self.samples) < self.samples.maxlen:
+            return False
+        (t0, w0), (t1, w1) = self.samples[0], self.samples[-1]
+        return t1 > t0 and (w1 - w0) / (t1 - t0) < SETTLED_FLOW_RATE
+
+
+class ParallelPourTracker:
+    """Follows a pour through several open valves at once, splitting the combined weight
+    between the components in proportion to their calibrated flow rates.
+
+    A closed valve keeps its share for its lag, while its in-flight liquid is still arriving."""
+
+    def __init__(self, pours: Dict[object, Tuple[FlowModel, float]], close=lambda key: None):
+        """
+        :param pours: (flow model, target weight) by component
+        :param close: callable closing the valve of a component
+        """
+        self.pours = pours
+        self.close = close
+        self.poured = {key: 0 for key in pours}
+        self.closed_at = {}
+        self.samples = deque(maxlen=FLOW_WINDOW)
+        self.last_weight = None
+
+    def _flowing(self, timestamp):
+        return [key for key, (model, _) in self.pours.items()
+                if key not in self.closed_at or timestamp - self.closed_at[key] < model.lag]
+
+    def flow_rate(self):
+        if len(self.samples) < 2:
+            return None
+        (t0, w0), (t1, w1) = self.samples[0], self.samples[-1]
+        return (w1 - w0) / (t1 - t0) if t1 > t0 else None
+
+    def observe(self, weight, timestamp):
+        """Closes the valves reaching their targets, returns True when all of them are closed"""
+        self.samples.append((timestamp, weight))
+        delta = weight - self.last_weight if self.last_weight is not None else weight
+        self.last_weight = weight
+
+        flowing = self._flowing(timestamp)
+        total_rate = sum(self.pours[key][0].flow_rate for key in flowing)
+        if not total_rate:
+            return len(self.closed_at) == len(self.pours)
+
+        measured_rate = self.flow_rate()
+        for key in flowing:
+            model, target = self.pours[key]
+            share = model.flow_rate / total_rate
+            self.poured[key] += delta * share
+
+            if key in self.closed_at:
+                continue
+
+            rate = measured_rate * share if measured_rate is not None else None
+            if self.poured[key] >= target or \
+                    (rate is not None and self.poured[key] + model.overshoot(rate) >= target):
+                self.closed_at[key] = timestamp
+                self.close(key)
+
+        return len(self.closed_at) == len(self.pours)
+
+    def finish(self, final_weight):
+        """Scales the per-component estimates to the settled total, returns them"""
+        estimated = sum(self.poured.values())
+        if estimated > 0:
+            for key in self.poured:
+                self.poured[key] *= final_weight / estimated
+        return self.poured
+
+
+class FlowModels(DefaultFactoryDict):
+    """FlowModels keyed by component name, optionally persisted to a json file"""
+
+    def __init__(self, path=None):
+        super().__init__(lambda name: FlowModel())
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        models = cls(path)
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    for name, params in json.load(f).items():
+                        models[name] = FlowModel(**params)
+            except (ValueError, TypeError):
+                logger.exception('Could not load flow models from %s, starting from scratch', path)
+        return models
+
+    def save(self):
+        if not self.path:
+            return
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({name: model.to_dict() for name, model in self.items()}, f, indent=2)
+        os.replace(tmp_path, self.path)
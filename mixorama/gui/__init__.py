@@ -2,8 +2,6 @@ import os
 import sys
 import logging
 
-from mixorama.usage import UsageManager
-
 logger = logging.getLogger(__name__)
 
 # cmdline arguments, logger and config setup are handled by mixorama
@@ -25,16 +23,9 @@ sys.stderr = sys_stderr
 logging.root = logging_root
 logging.getLogger('kivy').setLevel = kivy_logger_setlevel
 
-from os import path
 from typing import Dict
-from kivy.app import App
-from kivy.lang import Builder
-from kivy.uix.screenmanager import ScreenManager
 
-from mixorama.bartender import Bartender
-from mixorama.gui.main import MainWidget
-from mixorama.gui.settings import SettingsWidget
-from mixorama.recipes import Recipe
+# the App, the screens and the rest of kivy are imported by gui_run, see mixorama.gui.app
 
 
 def is_gui_available():
@@ -54,25 +45,6 @@ def gui_config(config: Dict[str, Dict[str, str]]):
                 Config.set(section, option, value)
 
 
-def gui_run(menu, bartender, usage_manager):
-    BartenderGuiApp(menu, bartender, usage_manager).run()
-
-
-class BartenderGuiApp(App):
-    def __init__(self, menu: Dict[str, Recipe], bartender: Bartender, usage_manager: UsageManager, **kwargs):
-        super(BartenderGuiApp, self).__init__(**kwargs)
-        self.menu = menu
-        self.bartender = bartender
-        self.usage_manager = usage_manager
-
-    def build(self):
-        dir = path.dirname(__file__)
-        sm = ScreenManager()
-
-        Builder.load_file(path.join(dir, 'main.kv'))
-        sm.add_widget(MainWidget(self.menu, self.bartender, name='main'))
-
-        Builder.load_file(path.join(dir, 'settings.kv'))
-        sm.add_widget(SettingsWidget(self.bartender, self.usage_manager, name='settings'))
-
-        return sm
+def gui_run(menu, bartender, usage_manager, orders, startup=None):
+    from mixorama.gui.app import BartenderGuiApp
+    BartenderGuiApp(menu, bartender, usage_manager, orders, startup).run()
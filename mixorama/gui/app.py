@@ -0,0 +1,68 @@
+from os import path
+from typing import Callable, Dict
+
+from kivy.app import App
+from kivy.clock import Clock
+from kivy.lang import Builder
+from kivy.uix.screenmanager import ScreenManager, Screen
+
+from mixorama.bartender import Bartender
+from mixorama.orders import OrderQueue
+from mixorama.recipes import Recipe
+from mixorama.usage import UsageManager
+from mixorama.util import StartupTimer
+
+GUI_DIR = path.dirname(__file__)
+
+
+def load_kv(name):
+    """Parses a kv file once, however many times the screens needing it are built"""
+    filename = path.join(GUI_DIR, name)
+    if filename not in Builder.files:
+        Builder.load_file(filename)
+
+
+class LazyScreenManager(ScreenManager):
+    """Builds the screens added with add_lazy_screen on the first navigation to them"""
+
+    def __init__(self, **kwargs):
+        self.factories = {}
+        ''':type: Dict[str, Callable[[], Screen]]'''
+        super().__init__(**kwargs)
+
+    def add_lazy_screen(self, name, factory: Callable[[], Screen]):
+        self.factories[name] = factory
+
+    def on_current(self, instance, value):
+        if value in self.factories and not self.has_screen(value):
+            self.add_widget(self.factories.pop(value)())
+        super().on_current(instance, value)
+
+
+class BartenderGuiApp(App):
+    def __init__(self, menu: Dict[str, Recipe], bartender: Bartender, usage_manager: UsageManager,
+                 orders: OrderQueue, startup: StartupTimer = None, **kwargs):
+        super(BartenderGuiApp, self).__init__(**kwargs)
+        self.menu = menu
+        self.bartender = bartender
+        self.usage_manager = usage_manager
+        self.orders = orders
+        self.startup = startup or StartupTimer()
+
+    def build(self):
+        sm = LazyScreenManager()
+
+        with self.startup.phase('main screen'):
+            from mixorama.gui.main import MainWidget
+            load_kv('main.kv')
+            sm.add_widget(MainWidget(self.menu, self.bartender, self.orders, name='main'))
+
+        sm.add_lazy_screen('settings', self.build_settings)
+
+        Clock.schedule_once(lambda dt: self.startup.report('the first frame'))
+        return sm
+
+    def build_settings(self):
+        from mixorama.gui.settings import SettingsWidget
+        load_kv('settings.kv')
+        return SettingsWidget(self.bartender, self.usage_manager, name='settings')
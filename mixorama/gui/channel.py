@@ -0,0 +1,26 @@
+from threading import Lock
+from collections import OrderedDict
+
+from kivy.clock import Clock
+
+
+class LatestOnClock:
+    """Hands the values put from any thread to the callback on the Kivy clock, at most once per frame.
+    Only the latest value per key is kept, so a fast producer never waits for the rendering."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._pending = OrderedDict()
+        self._lock = Lock()
+        self._trigger = Clock.create_trigger(self._flush)
+
+    def put(self, key, *args):
+        with self._lock:
+            self._pending[key] = args
+        self._trigger()
+
+    def _flush(self, dt=None):
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        for args in pending.values():
+            self.callback(*args)
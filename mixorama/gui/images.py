@@ -0,0 +1,101 @@
+"""Recipe images: pre-scaled to the preview size once on disk, kept decoded in memory within a byte budget."""
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from threading import Thread, get_ident
+from typing import Iterable, Optional, Tuple
+
+from kivy.core.image import Image as CoreImage
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mixorama', 'thumbnails')
+TEXTURE_BUDGET = 16 * 1024 * 1024  # bytes of decoded textures kept in memory
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    logger.warning('Could not import PIL, the recipe images will be shown full size')
+    PILImage = None
+
+
+class ThumbnailCache:
+    def __init__(self, directory=THUMBNAIL_DIR):
+        self.directory = directory
+
+    def _thumbnail_path(self, source, size: Tuple[int, int]):
+        stat = os.stat(source)
+        key = '{}:{}:{}:{}x{}'.format(os.path.abspath(source), stat.st_mtime, stat.st_size, *size)
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + os.path.splitext(source)[1])
+
+    def path(self, source, size: Optional[Tuple[int, int]]):
+        """The thumbnail of the source fitting the size, or the source itself until the thumbnail is made"""
+        if PILImage is None or not size:
+            return source
+        try:
+            thumbnail = self._thumbnail_path(source, size)
+        except OSError:
+            return source
+        return thumbnail if os.path.exists(thumbnail) else source
+
+    def make(self, source, size: Tuple[int, int]):
+        thumbnail = self._thumbnail_path(source, size)
+        if os.path.exists(thumbnail):
+            return thumbnail
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(thumbnail, get_ident())
+        with PILImage.open(source) as image:
+            image.thumbnail(size)
+            image.save(tmp_path, format=image.format)
+        os.replace(tmp_path, thumbnail)
+        return thumbnail
+
+    def warm(self, sources: Iterable[str], size: Tuple[int, int]):
+        """Makes the missing thumbnails in the background"""
+        if PILImage is None:
+            return
+        Thread(target=self._warm, args=(list(sources), size), name='thumbnails', daemon=True).start()
+
+    def _warm(self, sources, size):
+        for source in sources:
+            try:
+                self.make(source, size)
+            except (OSError, ValueError):
+                logger.exception('Could not make a thumbnail of %s', source)
+
+
+class TextureCache:
+    """Decoded images by path, the least recently used ones are dropped beyond the byte budget"""
+
+    def __init__(self, budget=TEXTURE_BUDGET, fallback=None):
+        """:param fallback: the image shown instead of the ones which could not be loaded"""
+        self.budget = budget
+        self.fallback = fallback
+        self.size = 0
+        self._textures = OrderedDict()
+
+    def get(self, path):
+        if path in self._textures:
+            self._textures.move_to_end(path)
+            return self._textures[path]
+
+        try:
+            texture = CoreImage(path).texture
+        except Exception:  # kivy's image loaders raise anything from IOError to a bare Exception
+            logger.exception('Could not load the image %s', path)
+            if not self.fallback or path == self.fallback:
+                return None
+            return self.get(self.fallback)
+
+        self._textures[path] = texture
+        self.size += self._bytes(texture)
+        while self.size > self.budget and len(self._textures) > 1:
+            _, evicted = self._textures.popitem(last=False)
+            self.size -= self._bytes(evicted)
+        return texture
+
+    @staticmethod
+    def _bytes(texture):
+        return texture.width * texture.height * 4
@@ -1,13 +1,17 @@
 import logging
-from threading import Thread
 from typing import Dict
 
+from kivy.clock import Clock
 from kivy.properties import ObjectProperty
 from kivy.uix.screenmanager import Screen
 from kivy.uix.togglebutton import ToggleButton
 
-from mixorama.bartender import Bartender, BartenderState, CocktailAbortedException
-from mixorama.recipes import Recipe
+from mixorama.bartender import Bartender, BartenderState, OutOfComponent
+from mixorama.gui.channel import LatestOnClock
+from mixorama.gui.images import ThumbnailCache, TextureCache
+from mixorama.orders import OrderQueue
+from mixorama.plan import compile_plan
+from mixorama.recipes import Component, Recipe
 from mixorama.statemachine import InvalidStateMachineTransition
 
 logger = logging.getLogger(__name__)
@@ -16,6 +20,9 @@ logger = logging.getLogger(__name__)
 MENU_ROWS = 4
 MENU_COLS = 3
 
+LOGO = 'mixorama/gui/logo.png'
+THUMBNAILS_DELAY = 0.5  # sec, the layout has to settle before the recipe images are scaled to it
+
 
 class MainWidget(Screen):
     menu_buttons = ObjectProperty(None)
@@ -42,10 +49,20 @@ class MainWidget(Screen):
     staged_recipe = None
     ''':type: Recipe'''
 
-    def __init__(self, menu: Dict[str, Recipe], bartender: Bartender, **kwargs):
+    def __init__(self, menu: Dict[str, Recipe], bartender: Bartender, orders: OrderQueue, **kwargs):
         super().__init__(**kwargs)
         self.bartender = bartender
+        self.orders = orders
         self.menu = menu
+        self.recipe_buttons = {}
+        ''':type: Dict[Recipe, ToggleButton]'''
+        self.thumbnails = ThumbnailCache()
+        self.textures = TextureCache(fallback=LOGO)
+        self.preview_size = None
+        self.pouring_progress = LatestOnClock(self.show_pouring_progress)
+        self.pour_steps = {}
+        ''':type: Dict[Recipe, Dict[Component, int]], the pour plan step of each component, counting from 1,
+        only ever touched on the Kivy thread'''
 
         bartender.on_sm_transitions(
             enum=BartenderState,
@@ -56,7 +73,10 @@ class MainWidget(Screen):
             ABORTED=self.on_abort
         )
 
+        on_image_size = Clock.create_trigger(self.on_image_size, THUMBNAILS_DELAY)
+        self.image.bind(size=lambda *a: on_image_size())
         self.build_cocktail_buttons(menu)
+        bartender.availability.on_change(self.on_availability_change)
         self.abort_btn.bind(on_press=self.on_abort_btn_press)
         self.make_btn.bind(on_press=self.on_make_btn_press)
 
@@ -75,6 +95,8 @@ class MainWidget(Screen):
                              allow_no_selection=False,
                              on_press=lambda b: self.stage_recipe(b.recipe))
             b.recipe = recipe
+            b.disabled = not self.bartender.can_make_drink(recipe)
+            self.recipe_buttons[recipe] = b
 
             # set text width to 85% of the button width
             b.bind(width=lambda bt, w: setattr(bt, 'text_size', (w*.85, None)))
@@ -89,10 +111,14 @@ class MainWidget(Screen):
         self.set_cocktail_info(recipe)
         self.set_description_text(recipe.description)
 
-        if recipe.image:
-            self.image.source = recipe.image
-        else:
-            self.image.source = "mixorama/gui/logo.png"
+        source = self.thumbnails.path(recipe.image, self.preview_size) if recipe.image else LOGO
+        self.image.texture = self.textures.get(source)
+
+    def on_image_size(self, dt=None):
+        size = tuple(int(v) for v in self.image.size)
+        if size != self.preview_size:
+            self.preview_size = size
+            self.thumbnails.warm({r.image for r in self.menu.values() if r.image}, size)
 
     def set_cocktail_info(self, recipe: Recipe):
         self.info_ul.text = "Volume: {} ml\nStrength: {:.1f}%".format(
@@ -112,35 +138,32 @@ class MainWidget(Screen):
 
     def on_abort_btn_press(self, target):
         try:
-            self.bartender.abort()
+            self.orders.abort()
         except InvalidStateMachineTransition as e:
             logger.exception(e)
 
     def on_make_btn_press(self, target):
         if self.staged_recipe:
-            def maker():
-                try:
-                    self.bartender.make_drink(recipe=self.staged_recipe)
-                    self.bartender.serve()
-                except CocktailAbortedException:
-                    logger.info('Cocktail making or serving was aborted')
-                    self.bartender.discard()
-                except Exception:
-                    logger.exception('Unhandled exception on_make_btn_press()-> maker()')
-
-            Thread(daemon=True, target=maker).start()
+            try:
+                self.orders.submit(self.staged_recipe, source='gui')
+            except OutOfComponent:
+                logger.info('Not enough components for %s', self.staged_recipe.name)
+                self.set_status_text('Not enough components')
 
     def on_idle(self):
         self.make_btn.disabled = False
         self.abort_btn.disabled = True
-
-        for b in self.menu_buttons.children:
-            b.disabled = not self.bartender.can_make_drink(b.recipe)
-
         self.set_status_text('Ready!')
         self.reset_progress()
 
+    def on_availability_change(self, recipe, available):
+        if recipe in self.recipe_buttons:
+            button = self.recipe_buttons[recipe]
+            Clock.schedule_once(lambda dt: setattr(button, 'disabled', not self.bartender.can_make_drink(recipe)))
+
     def on_making(self):
+        # the plans are recompiled as the flows are learned; cleared on the clock, ahead of the drink's progress
+        Clock.schedule_once(lambda dt: self.pour_steps.clear())
         self.make_btn.disabled = True
         self.abort_btn.disabled = False
         self.set_status_text('Making the drink..')
@@ -154,6 +177,15 @@ class MainWidget(Screen):
         self.set_status_text("Cocktail aborted\nTake the glass")
 
     def on_pouring_progress(self, recipe, component, done, volume):
-        recipe_progress = ([c[0] for c in recipe].index(component) + 1) / len(recipe)
-        self.total_progress.value = recipe_progress * 100
-        self.step_progress.value = done / volume * 100
\ No newline at end of file
+        self.pouring_progress.put(component, recipe, component, done, volume)
+
+    def show_pouring_progress(self, recipe, component, done, volume):
+        steps = self.pour_steps.get(recipe)
+        if steps is None:
+            # compiled here, the bartender's plans belong to the engine thread
+            plan = compile_plan(recipe, self.bartender.flow_models, self.bartender.parallel_pour,
+                                self.bartender.dense_first)
+            steps = self.pour_steps[recipe] = {c: i for i, step in enumerate(plan, 1) for c in step.components}
+
+        self.total_progress.value = steps.get(component, 0) / max(steps.values()) * 100
+        self.step_progress.value = done / volume * 100
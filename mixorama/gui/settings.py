@@ -1,7 +1,6 @@
 import os
 
 from kivy.clock import Clock
-from kivy.input import MotionEvent
 from kivy.properties import ObjectProperty
 from kivy.uix.label import Label
 from kivy.uix.screenmanager import Screen
@@ -58,14 +57,18 @@ class SettingsWidget(Screen):
             Clock.unschedule(self.scales_interval)
 
     def on_monitor_scales_press(self, lbl, t):
-        """Press on the scales monitor sets the tare"""
+        """Press on the scales monitor sets the tare, once the engine gets to it"""
         if not lbl.collide_point(*t.pos):
             return
-        self.bartender.scales.reset(stabilize=False)
-        self.update_scales_monitor()
+        self.monitor_scales.text = 'taring..'
+        self.bartender.tare()
 
     def update_scales_monitor(self, dt=None):
-        self.scales_value = self.bartender.scales.measure(autostop=True)
+        weight = self.bartender.scales.latest_weight()
+        if weight is None:
+            self.monitor_scales.text = 'no data'
+            return
+        self.scales_value = weight
         self.monitor_scales.text = '%.2f gr.' % self.scales_value
 
     def build_component_sliders(self):
@@ -80,24 +83,27 @@ class SettingsWidget(Screen):
             # hook for text autoresize
             label.bind(width=lambda bt, w: setattr(bt, 'text_size', (w*.85, None)))
 
-            def update_component(target, value_or_touch, c=component, l=label, s=slider):
-                if isinstance(value_or_touch, MotionEvent) and not target.collide_point(*value_or_touch.pos):
+            def preview_component(s, value, c=component, l=label):
+                l.text = '%s:\n%d ml' % (c.name, value)
+
+            def fill_component(target, touch, c=component, s=slider):
+                # the level is committed once the slider is released or its label is pressed
+                if not target.collide_point(*touch.pos):
                     return
 
-                if self.monitor_scales_chk.active:
-                    value_for_label_press = self.scales_value * c.density  # scales gives us grams
+                if target is s:
+                    value = s.value
+                elif self.monitor_scales_chk.active:
+                    value = self.scales_value * c.density  # scales gives us grams
                 else:
-                    value_for_label_press = c.volume  # ml
-
-                value = value_or_touch if isinstance(target, Slider) else value_for_label_press
+                    value = c.volume  # ml
 
-                l.text = str(c)
-                c.fill(value)
+                c.fill(int(value))
                 s.value = value
 
-            slider.bind(value=update_component)
-            label.bind(on_touch_move=update_component)
-            label.bind(on_touch_up=update_component)
+            slider.bind(value=preview_component)
+            slider.bind(on_touch_up=fill_component)
+            label.bind(on_touch_up=fill_component)
             self.component_records.append((component, slider, label))
 
             self.components.add_widget(label)
@@ -0,0 +1,169 @@
+"""Bottle levels surviving restarts and crashes: a compact snapshot plus a log of the changes made since."""
+import atexit
+import json
+import logging
+import os
+from queue import Queue
+from threading import Lock, Thread
+
+from mixorama.recipes import Component
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL = 100  # logged changes, after which they are compacted into a snapshot
+WRITE_BATCH_SIZE = 100  # logged changes sharing an fsync, at most
+
+
+class Inventory:
+    """Records the spent volume of every tracked component.
+
+    Each change is appended to <path>.log as a json line with the resulting level, so replaying it
+    is idempotent and a torn last line after a crash is simply skipped. Every SNAPSHOT_INTERVAL
+    changes the levels are written to <path>.json atomically, and the log is started over.
+
+    The files are written on a writer thread, a use or fill only queues its entry: the entries queued
+    while the previous batch was being written share a single fsync."""
+
+    _SNAPSHOT = object()
+    _STOP = object()
+
+    def __init__(self, path=None, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.levels = {}
+        ''':type: Dict[str, int], spent volume by component name'''
+        self.seq = 0
+        self._logged = 0
+        self._log = None
+        self._tracked = set()
+        self._lock = Lock()
+        self._queue = Queue()
+        self._writer = None
+
+    @property
+    def snapshot_path(self):
+        return self.path + '.json'
+
+    @property
+    def log_path(self):
+        return self.path + '.log'
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        inventory = cls(path, **kwargs)
+        if path:
+            inventory._load_snapshot()
+            inventory._replay_log()
+            inventory._log = open(inventory.log_path, 'a')
+            if inventory._log.tell():  # compacting the replayed tail, which may end with a torn line
+                inventory._snapshot()
+            inventory._writer = Thread(target=inventory._run, name='inventory-writer', daemon=True)
+            inventory._writer.start()
+            atexit.register(inventory.close)
+        return inventory
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            self.seq = snapshot['seq']
+            self.levels.update(snapshot['levels'])
+        except (ValueError, KeyError, TypeError):
+            logger.exception('Could not load the inventory snapshot %s, replaying the log only', self.snapshot_path)
+
+    def _replay_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    logger.warning('Skipping a damaged inventory log entry: %r', line)
+                    continue
+                if event['seq'] > self.seq:  # older ones are in the snapshot already
+                    self.seq = event['seq']
+                    self.levels[event['name']] = event['spent']
+                    self._logged += 1
+
+    def restore(self, component: Component):
+        """Sets the component's level to the recorded one and starts recording its changes"""
+        if id(component) in self._tracked:
+            return component
+        self._tracked.add(id(component))
+
+        if component.name in self.levels:
+            component.spent = self.levels[component.name]
+        component.on_change(self.record)
+        return component
+
+    def record(self, component: Component, event: str, volume):
+        """Queues the change for the writer, returning immediately"""
+        with self._lock:  # queued in the seq order
+            self.seq += 1
+            self.levels[component.name] = component.spent
+            if self._writer is None:
+                return
+
+            self._queue.put(json.dumps(dict(seq=self.seq, name=component.name, spent=component.spent,
+                                            event=event, volume=volume)) + '\n')
+
+    def snapshot(self):
+        """Queues a compaction of the log, after the changes queued before it"""
+        if self._writer is not None:
+            self._queue.put(self._SNAPSHOT)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if not self._write(batch):
+                break
+
+    def _write(self, batch):
+        """Writes the batch with a single fsync, returns False once it's time to stop"""
+        lines = [item for item in batch if isinstance(item, str)]
+        stop = self._STOP in batch
+        try:
+            if lines:
+                self._log.write(''.join(lines))
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._logged += len(lines)
+
+            if self._SNAPSHOT in batch or self._logged >= self.snapshot_interval or (stop and self._logged):
+                self._snapshot()
+        except OSError:
+            logger.exception('Could not write %d inventory changes', len(lines))
+        return not stop
+
+    def _snapshot(self):
+        with self._lock:
+            snapshot = dict(seq=self.seq, levels=dict(self.levels))
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # a crash before the truncation is harmless, the snapshot's seq covers every logged entry,
+        # as well as the queued ones, which replaying skips
+        self._log.seek(0)
+        self._log.truncate()
+        self._logged = 0
+
+    def close(self):
+        """Writes out whatever is queued and compacts the log"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is None:
+            return
+
+        self._queue.put(self._STOP)
+        writer.join()
+        self._log.close()
+        self._log = None
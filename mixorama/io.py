@@ -50,6 +50,8 @@ class Button:
 
 
 class Valve:
+    is_open = False
+
     def __init__(self, channel):
         self.channel = channel
         with warnings.catch_warnings(record=True) as w:
@@ -61,6 +63,8 @@ class Valve:
 
     def open(self):
         gpio_output(self.channel, 0)
+        self.is_open = True
 
     def close(self):
         gpio_output(self.channel, 1)
+        self.is_open = False
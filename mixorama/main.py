@@ -6,10 +6,20 @@ import yaml
 import click
 import attr
 
-from mixorama.factory import create_bartender, create_bar, create_menu, create_shelf, create_usage_manager
+from mixorama.factory import create_bartender, create_bar, create_menu, create_shelf, create_usage_manager, \
+    create_order_queue, create_inventory, create_catalog, create_tracer, create_metrics_exporter
+from mixorama.flow import FlowModels
+from mixorama.metrics import REGISTRY, Counter, Histogram, read_text
+from mixorama.scales import ScalesTimeoutException
+from mixorama.bench import BENCH_RUNS, bench_bar, run_bench, save_results, load_results, compare
+from mixorama.catalog import import_wikipedia, normalize_name
+from mixorama.optimizer import optimize_bar, score_bar
 from mixorama.recipes import Recipe
+from mixorama.stats import UsageStats
+from mixorama.usage import RollupPeriod
 from mixorama.ui import cli_run, bind_hw_buttons
 from mixorama.io import cleanup
+from mixorama.util import StartupTimer
 
 CONFIG_PATH = 'mixorama.yaml'
 
@@ -28,27 +38,48 @@ class Context:
     ''':type: mixorama.usage_manager.UsageManager'''
     menu = attr.ib()
     ''':type: Dict[str, Recipe]'''
+    orders = attr.ib(default=None)
+    ''':type: mixorama.orders.OrderQueue'''
+    inventory = attr.ib(default=None)
+    ''':type: mixorama.inventory.Inventory'''
+    startup = attr.ib(default=attr.Factory(StartupTimer))
+    ''':type: StartupTimer'''
+    tracer = attr.ib(default=None)
+    ''':type: mixorama.tracing.Tracer'''
+    metrics = attr.ib(default=None)
+    ''':type: mixorama.metrics.MetricsExporter'''
 
 
 @click.group()
 @click.option('--conf', default=CONFIG_PATH, type=click.Path(dir_okay=False))
 @click.pass_context
 def cli(ctx: click.Context, conf: str) -> None:
-    with open(conf) as cfg_file:
-        cfg = yaml.load(cfg_file)
+    startup = StartupTimer()
 
-    loglevel = cfg.get('logging', {}).get('level', 'INFO')
-    logging.basicConfig(stream=sys.stdout, level=getattr(logging, loglevel))
+    with startup.phase('config'):
+        with open(conf) as cfg_file:
+            cfg = yaml.load(cfg_file)
 
-    shelf = create_shelf(cfg.get('shelf'))
-    bar = create_bar(shelf, cfg.get('bar'))
-    bartender = create_bartender(bar, cfg.get('bartender'))
-    menu = create_menu(bar, cfg.get('menu'))
+        loglevel = cfg.get('logging', {}).get('level', 'INFO')
+        logging.basicConfig(stream=sys.stdout, level=getattr(logging, loglevel))
+
+    with startup.phase('inventory'):
+        inventory = create_inventory(cfg.get('inventory'))
+        shelf = create_shelf(cfg.get('shelf'), inventory)
+        bar = create_bar(shelf, cfg.get('bar'), inventory)
+
+    with startup.phase('bartender'):
+        bartender = create_bartender(bar, cfg.get('bartender'))
+
+    with startup.phase('menu'):
+        menu = create_menu(bar, cfg.get('menu'))
+        bartender.compile_plans(menu.values())
 
     # Usage Manager simply hooks
-    usage_manager = create_usage_manager(bartender, cfg.get('usage'))
+    with startup.phase('usage db'):
+        usage_manager = create_usage_manager(bartender, cfg.get('usage'))
 
-    ctx.obj = Context(cfg, shelf, bar, bartender, usage_manager, menu)
+    ctx.obj = Context(cfg, shelf, bar, bartender, usage_manager, menu, inventory=inventory, startup=startup)
 
 
 @cli.command(name='run')
@@ -58,20 +89,34 @@ def run(ctx: click.Context, gui: bool):
     ctx = ctx.obj
     ''':type: Context'''
 
+    with ctx.startup.phase('metrics'):
+        ctx.tracer = create_tracer(ctx.bartender)
+        ctx.metrics = create_metrics_exporter(ctx.cfg.get('metrics'), ctx.tracer)
+    with ctx.startup.phase('orders'):
+        ctx.orders = create_order_queue(ctx.bartender)
     try:
-        bind_hw_buttons(ctx.menu, ctx.bartender, ctx.cfg.get('buttons', {}))
+        bind_hw_buttons(ctx.menu, ctx.orders, ctx.cfg.get('buttons', {}))
 
         if gui:
-            from mixorama.gui import is_gui_available, gui_config, gui_run
-            gui_config(ctx.cfg.get('kivy', {}))
-            if is_gui_available():
-                gui_run(ctx.menu, ctx.bartender, ctx.usage_manager)
+            with ctx.startup.phase('kivy'):
+                from mixorama.gui import is_gui_available, gui_config, gui_run
+                gui_config(ctx.cfg.get('kivy', {}))
+                gui_available = is_gui_available()
+            if gui_available:
+                gui_run(ctx.menu, ctx.bartender, ctx.usage_manager, ctx.orders, ctx.startup)
             else:
                 print('GUI is not available on this system')
         else:
-            cli_run(ctx.menu, ctx.bartender)
+            ctx.startup.report('the cli')
+            cli_run(ctx.menu, ctx.orders)
 
     finally:
+        ctx.orders.stop()
+        ctx.bartender.engine.stop()
+        ctx.bartender.scales.stop()
+        ctx.usage_manager.close()
+        ctx.inventory.close()
+        ctx.metrics.stop()
         cleanup()
 
 
@@ -143,11 +188,190 @@ def scales(ctx: click.Context):
     ctx = ctx.obj
     ''':type: Context'''
 
-    impl = ctx.bartender.scales.scales
+    samples = ctx.bartender.scales.subscribe()
+    try:
+        while True:
+            for sample in samples.wait():
+                print(sample.value)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ctx.bartender.scales.stop()
+
+
+SCALES_METRICS = ('mixorama_scales_', 'mixorama_valve_')
+
+
+@cli.command('scales-stats')
+@click.option('--url', default=None, help='the metrics of a running mixorama, e.g. http://localhost:9101/metrics')
+@click.option('--duration', type=float, default=10, help='sec to watch the scales for, without --url')
+@click.pass_context
+def scales_stats(ctx: click.Context, url: str, duration: float):
+    ctx = ctx.obj
+    ''':type: Context'''
+
+    if url:
+        from urllib.request import urlopen
+        with urlopen(url, timeout=10) as response:
+            registry = read_text(response.read().decode())
+    else:
+        print('Watching the scales for {} sec...'.format(duration))
+        try:  # acting on every sample as a pour would, without ever reaching a target
+            ctx.bartender.scales.wait_for_weight(0, duration * 1000, until=lambda weight, timestamp: False)
+        except ScalesTimeoutException:
+            pass
+        finally:
+            ctx.bartender.scales.stop()
+        registry = REGISTRY
+
+    for metric in registry:
+        if not metric.name.startswith(SCALES_METRICS):
+            continue
+        print('{}: {}'.format(metric.name, metric.documentation))
+        for labels in metric.labelsets() or ([{}] if isinstance(metric, Counter) and not metric.labelnames else []):
+            name = ', '.join('{}={}'.format(k, v) for k, v in labels.items()) or 'all'
+            if isinstance(metric, Histogram):
+                count = metric.count(**labels)
+                print('  {:<30} {:g} observed, mean {:.4f}, p50 <= {}, p95 <= {}, p99 <= {}'.format(
+                    name, count, metric.sum(**labels) / count if count else 0, metric.quantile(.5, **labels),
+                    metric.quantile(.95, **labels), metric.quantile(.99, **labels)))
+            else:
+                print('  {:<30} {:g}'.format(name, metric.value(**labels)))
+
+
+@cli.command('stats')
+@click.option('--period', type=click.Choice([p.value for p in RollupPeriod]), default=RollupPeriod.DAY.value)
+@click.option('--since', type=click.DateTime(), default=None)
+@click.option('--until', type=click.DateTime(), default=None)
+@click.option('--rebuild', is_flag=True, help='recompute the rollups from the raw usage history')
+@click.pass_context
+def stats(ctx: click.Context, period: str, since, until, rebuild: bool):
+    ctx = ctx.obj
+    ''':type: Context'''
+
+    usage_stats = UsageStats(ctx.usage_manager.writer)
+    if rebuild:
+        usage_stats.rebuild()
+    period = RollupPeriod(period)
 
-    impl.reset()
-    while True:
-        print(impl.get_raw_data(1))
+    print('Drinks per {}:'.format(period.value))
+    for bucket, name, result, count in usage_stats.drinks(period, since, until):
+        print('  {}  {:<30} {:<8} {}'.format(bucket, name, result.value, count))
+
+    print('Components per {}:'.format(period.value))
+    for bucket, name, volume, count in usage_stats.components(period, since, until):
+        print('  {}  {:<30} {} ml in {} pours'.format(bucket, name, volume, count))
+
+    print('Refills per {}:'.format(period.value))
+    for bucket, name, count in usage_stats.refills(period, since, until):
+        print('  {}  {:<30} {}'.format(bucket, name, count))
+
+    print('Most popular drinks:')
+    for name, count in usage_stats.drink_totals(since, until).items():
+        print('  {:<30} {}'.format(name, count))
+
+    print('Most used components:')
+    for name, volume in usage_stats.component_totals(since, until).items():
+        print('  {:<30} {} ml'.format(name, volume))
+
+
+@cli.command('catalog')
+@click.option('--import', 'import_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='scraped wikipedia cocktails to add, e.g. docs/wiki/cocktails_w_info.json')
+@click.pass_context
+def catalog(ctx: click.Context, import_path: str):
+    ctx = ctx.obj
+    ''':type: Context'''
+
+    recipes = create_catalog(ctx.cfg.get('catalog'))
+    if import_path:
+        import_wikipedia(import_path, recipes)
+        recipes.save()
+        print('{} recipes of {} ingredients in the catalog'.format(len(recipes), len(recipes.ingredients)))
+
+    print('The bar can make:')
+    for recipe in recipes.makeable(ctx.bar):
+        print('  {}: {}'.format(recipe.name, ', '.join('{} ml of {}'.format(v, i) for i, v in recipe.sequence)))
+
+
+@cli.command('optimize-bar')
+@click.option('--valves', type=int, default=None, help='defaults to the number of bottles in the bar')
+@click.option('--catalog/--no-catalog', 'use_catalog', default=False, help='consider the catalog recipes too')
+@click.option('--keep', multiple=True, help='a bottle to mount anyway')
+@click.pass_context
+def optimize_bar_cmd(ctx: click.Context, valves: int, use_catalog: bool, keep):
+    ctx = ctx.obj
+    ''':type: Context'''
+
+    unknown = [name for name in keep if name not in ctx.shelf]
+    if unknown:
+        raise click.BadParameter('not on the shelf: {}'.format(', '.join(unknown)), param_hint='--keep')
+    valves = valves or len(ctx.bar)
+    if len(set(keep)) > valves:
+        raise click.BadParameter('{} bottles do not fit {} valves'.format(len(set(keep)), valves), param_hint='--keep')
+
+    shelf = {normalize_name(name): name for name in ctx.shelf}
+    recipes = {}
+    for key, sequence in ctx.cfg.get('menu', {}).items():
+        name = ctx.menu[key].name if key in ctx.menu else key
+        recipes[name] = [c for c in sequence if c != 'meta']
+    if use_catalog:
+        for recipe in create_catalog(ctx.cfg.get('catalog')):
+            recipes.setdefault(recipe.name, [shelf.get(i, i) for i, _ in recipe.sequence])
+
+    popularity = UsageStats(ctx.usage_manager.writer).drink_totals()
+    weights = {name: 1 + popularity.get(name, 0) for name in recipes}
+
+    current = score_bar(recipes, [c.name for c in ctx.bar], weights)
+    plan = optimize_bar(recipes, ctx.shelf, valves, weights, keep)
+
+    print('Now: {} makes {} drinks, scored {}'.format(', '.join(current.components), len(current.recipes),
+                                                     current.score))
+    print('Mount: {}'.format(', '.join(plan.components)))
+    print('To make {} drinks, scored {}:'.format(len(plan.recipes), plan.score))
+    for name in sorted(plan.recipes, key=lambda n: -weights[n]):
+        print('  {:<30} made {} times'.format(name, weights[name] - 1))
+
+
+@cli.command('bench')
+@click.option('--runs', type=int, default=BENCH_RUNS, help='drinks per recipe')
+@click.option('--output', type=click.Path(dir_okay=False), default='bench.json')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='the results of an earlier bench to compare with')
+@click.option('--learned/--fresh', 'learned', default=True, help='start from the learned flow models or from scratch')
+@click.option('--seed', type=int, default=0, help='of the simulated sensor noise')
+@click.pass_context
+def bench(ctx: click.Context, runs: int, output: str, baseline: str, learned: bool, seed: int):
+    ctx = ctx.obj
+    ''':type: Context'''
+
+    config = dict(ctx.cfg.get('bartender', {}))
+    config['simulator'] = dict(config.get('simulator') or {}, seed=seed)
+    bar, recipes = bench_bar(ctx.bar, ctx.menu.values())
+    bartender = create_bartender(bar, config)
+    if not learned:
+        bartender.flow_models = FlowModels()
+    bartender.flow_models.path = None  # learning on the simulator must not touch the real models
+    try:
+        results = run_bench(bartender, recipes, runs)
+    finally:
+        bartender.engine.stop()
+        bartender.scales.stop()
+    save_results(results, output)
+
+    total = results['total']
+    print('{} drinks, {} aborted: {:.1f} sec per drink, {:.0f} drinks per hour, {:.1f} gr off'.format(
+        total['runs'], total['aborted'], total['drink_time'].get('mean', 0), total['drinks_per_hour'],
+        total['abs_weight_error'].get('mean', 0)))
+    for phase, summary in total['phases'].items():
+        print('  {:<30} {:.2f} sec, p95 {:.2f}'.format(phase, summary['mean'], summary['p95']))
+    print('Results written to {}'.format(output))
+
+    if baseline:
+        print('Compared to {}:'.format(baseline))
+        for name, metric, before, current, change, better in compare(results, load_results(baseline)):
+            print('  {:<20} {:<24} {:>10.3f} -> {:<10.3f} {:+.1f}%{}'.format(
+                name, metric, before, current, change, ' better' if better else ''))
 
 
 __name__ == '__main__' and cli()
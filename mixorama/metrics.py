@@ -0,0 +1,337 @@
+"""Counters and histograms in the Prometheus text format, served over http or written to a textfile.
+
+A node_exporter's textfile collector picks up the textfile, or Prometheus scrapes the port directly.
+The port serves the latest drink traces as json on /traces too."""
+import json
+import logging
+import math
+import os
+import re
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Event, Lock, Thread
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 20, 30, 60)  # sec
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)  # sec
+TEXTFILE_INTERVAL = 15  # sec
+METRICS_HOST = '127.0.0.1'  # loopback only, serving the LAN takes an explicit host
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                          for k, v in pairs) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = OrderedDict()
+        self._lock = Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{} is labelled by {}, not {}'.format(self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def labelsets(self) -> List[Dict[str, str]]:
+        with self._lock:
+            keys = list(self._values)
+        return [dict(zip(self.labelnames, key)) for key in keys]
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """(name, labels, value) lines of the exposition"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.type)]
+        lines += ['{}{} {}'.format(name, labels, _format_value(value)) for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name + '_total', _format_labels(self.labelnames, key), value) for key, value in values]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in values]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames: Iterable[str] = (), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + ((math.inf,) if math.inf not in buckets else ())
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+
+    def _counts(self, labels):
+        """A copy of the bucket counts and the sum, None before any observation"""
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            return (list(counts[0]), counts[1]) if counts else None
+
+    def count(self, **labels):
+        counts = self._counts(labels)
+        return sum(counts[0]) if counts else 0
+
+    def sum(self, **labels):
+        counts = self._counts(labels)
+        return counts[1] if counts else 0.0
+
+    def quantile(self, q, **labels):
+        """The upper bound of the bucket holding the q quantile, None before any observation"""
+        counts = self._counts(labels)
+        if not counts or not sum(counts[0]):
+            return None
+        rank, cumulative = q * sum(counts[0]), 0
+        for bound, count in zip(self.buckets, counts[0]):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts[0]), counts[1]) for key, counts in self._values.items()]
+
+        samples = []
+        for key, buckets, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, buckets):
+                cumulative += count
+                samples.append((self.name + '_bucket',
+                                _format_labels(self.labelnames, key, [('le', _format_value(bound))]), cumulative))
+            samples.append((self.name + '_sum', _format_labels(self.labelnames, key), total))
+            samples.append((self.name + '_count', _format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = OrderedDict()
+        ''':type: Dict[str, Metric]'''
+        self._lock = Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            metric = self._metrics[name]
+        if not isinstance(metric, cls):
+            raise ValueError('{} is already registered as a {}'.format(name, metric.type))
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._metrics.values()))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self) + '\n'
+
+
+REGISTRY = Registry()
+
+_SAMPLE_RE = re.compile(r'^(?P<name>[a-zA-Z_:][\w:]*)(?:\{(?P<labels>.*)\})?\s+(?P<value>\S+)')
+_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+_SUFFIXES = {'counter': ('_total',), 'gauge': ('',), 'histogram': ('_bucket', '_sum', '_count')}
+
+
+def _unescape(value):
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), value)
+
+
+def _parse_value(text):
+    return {'+Inf': math.inf, '-Inf': -math.inf}.get(text) or float(text)
+
+
+def read_text(text: str) -> Registry:
+    """The registry of the exposition, e.g. scraped from a running mixorama"""
+    helps, types, samples = {}, OrderedDict(), {}
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            name, _, documentation = line[7:].partition(' ')
+            helps[name] = documentation
+        elif line.startswith('# TYPE '):
+            name, _, kind = line[7:].partition(' ')
+            types[name] = kind.strip()
+        elif line and not line.startswith('#'):
+            match = _SAMPLE_RE.match(line)
+            if match:
+                labels = OrderedDict((k, _unescape(v)) for k, v in _LABEL_RE.findall(match.group('labels') or ''))
+                samples.setdefault(match.group('name'), []).append((labels, _parse_value(match.group('value'))))
+
+    registry = Registry()
+    for name, kind in types.items():
+        if kind not in _SUFFIXES:
+            continue
+        lines = {suffix: samples.get(name + suffix, []) for suffix in _SUFFIXES[kind]}
+        labelnames = [k for k in next((l for sl in lines.values() for l, _ in sl), {}) if k != 'le']
+
+        if kind == 'histogram':
+            buckets = sorted({labels['le'] for labels, _ in lines['_bucket']}, key=_parse_value)
+            metric = registry.histogram(name, helps.get(name, ''), labelnames, [_parse_value(b) for b in buckets])
+            cumulative = {}
+            for labels, value in lines['_bucket']:
+                key = tuple(labels.get(n, '') for n in labelnames)
+                cumulative.setdefault(key, {})[_parse_value(labels['le'])] = value
+            for labels, value in lines['_sum']:
+                key = tuple(labels.get(n, '') for n in labelnames)
+                counts = [cumulative.get(key, {}).get(bound, 0) for bound in metric.buckets]
+                metric._values[key] = [[c - p for c, p in zip(counts, [0] + counts[:-1])], value]
+        else:
+            metric = getattr(registry, kind)(name, helps.get(name, ''), labelnames)
+            for labels, value in lines[_SUFFIXES[kind][0]]:
+                metric._values[tuple(labels.get(n, '') for n in labelnames)] = value
+
+    return registry
+
+
+def write_textfile(path, registry: Registry = REGISTRY):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+    traces = None
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path in ('/', '/metrics'):
+            body, content_type = self.registry.render().encode(), CONTENT_TYPE
+        elif path == '/traces' and self.traces is not None:
+            body, content_type = json.dumps(self.traces(), indent=2).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+class MetricsExporter:
+    """Serves the registry on the port and/or rewrites the textfile every interval, in daemon threads"""
+
+    def __init__(self, registry: Registry = REGISTRY, port=None, host=METRICS_HOST, textfile=None,
+                 interval=TEXTFILE_INTERVAL, traces=None):
+        """
+        :param traces: callable returning the json-able traces to serve on /traces, e.g. Tracer.latest
+        """
+        self.registry = registry
+        self.traces = traces
+        self.port = port
+        self.host = host
+        self.textfile = textfile
+        self.interval = interval
+        self._server = None
+        self._stop_event = Event()
+        self._threads = []
+
+    def start(self):
+        if self.port is not None:
+            handler = type('MetricsHandler', (_MetricsHandler,), dict(registry=self.registry,
+                                                                      traces=staticmethod(self.traces)))
+            self._server = HTTPServer((self.host, self.port), handler)
+            self._threads.append(Thread(target=self._server.serve_forever, name='metrics-http', daemon=True))
+            logger.info('Serving the metrics on http://%s:%d/metrics', self.host, self.port)
+        if self.textfile:
+            self._threads.append(Thread(target=self._write_textfile, name='metrics-textfile', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _write_textfile(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        if not self.textfile:
+            return
+        try:
+            write_textfile(self.textfile, self.registry)
+        except OSError:
+            logger.exception('Could not write the metrics to %s', self.textfile)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self.write()  # the final values
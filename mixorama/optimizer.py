@@ -0,0 +1,133 @@
+"""Chooses the bottles to mount on the limited valve bank.
+
+A recipe counts once every one of its components is mounted, weighted by its popularity.
+Picking the best k bottles is NP-hard, so a greedy pick is improved by swapping bottles
+while that helps. Recipes are grouped by their component bitmasks and indexed by component,
+so a pick or a swap is scored with mask tests over the recipes using the components involved."""
+import logging
+from typing import Dict, Iterable, List
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+MAX_SWAP_ROUNDS = 50
+
+
+@attr.s
+class BarPlan:
+    components = attr.ib()
+    ''':type: List[str]'''
+    recipes = attr.ib()
+    ''':type: List[str], the recipes the components can make'''
+    score = attr.ib()
+    ''':type: float, the summed up weight of the recipes'''
+
+
+def _popcount(mask):
+    return bin(mask).count('1')
+
+
+class _Problem:
+    def __init__(self, recipes: Dict[str, Iterable[str]], weights: Dict[str, float],
+                 candidates: Iterable[str], valves: int):
+        self.candidates = sorted(set(candidates))
+        self.bits = {c: 1 << i for i, c in enumerate(self.candidates)}
+        self.recipes = {}
+        ''':type: Dict[int, List[str]], recipe names by mask'''
+        groups = {}
+        for name, components in recipes.items():
+            components = set(components)
+            if not components or len(components) > valves or not components.issubset(self.bits):
+                continue  # can never be made
+            mask = 0
+            for component in components:
+                mask |= self.bits[component]
+            self.recipes.setdefault(mask, []).append(name)
+            groups[mask] = groups.get(mask, 0) + weights.get(name, 1)
+        self.groups = [(mask, weight, _popcount(mask)) for mask, weight in groups.items()]
+        ''':type: List[Tuple[int, float, int]], (mask, weight, components) per distinct mask'''
+        self.by_bit = {bit: [g for g in self.groups if g[0] & bit] for bit in self.bits.values()}
+
+    def score(self, chosen: int) -> float:
+        missing = ~chosen
+        return sum(weight for mask, weight, _ in self.groups if not mask & missing)
+
+    def gain(self, chosen: int, bit: int) -> float:
+        """How much mounting the bit's component adds to the score of the chosen ones"""
+        missing = ~(chosen | bit)
+        return sum(weight for mask, weight, _ in self.by_bit[bit] if not mask & missing)
+
+    def loss(self, chosen: int, bit: int) -> float:
+        """How much unmounting the bit's component takes from the score of the chosen ones"""
+        missing = ~chosen
+        return sum(weight for mask, weight, _ in self.by_bit[bit] if not mask & missing)
+
+    def potential(self, bit: int) -> float:
+        """The weight of the recipes using the bit's component, in proportion, to tell apart the first picks"""
+        return sum(weight / size for _, weight, size in self.by_bit[bit])
+
+    def plan(self, chosen: int) -> BarPlan:
+        missing = ~chosen
+        return BarPlan(components=[c for c in self.candidates if chosen & self.bits[c]],
+                       recipes=[n for mask, names in self.recipes.items() if not mask & missing for n in names],
+                       score=self.score(chosen))
+
+
+def _greedy(problem: _Problem, valves: int, chosen=0) -> int:
+    while _popcount(chosen) < valves:
+        options = [bit for bit in problem.bits.values() if not chosen & bit]
+        if not options:
+            break
+        chosen |= max(options, key=lambda bit: (problem.gain(chosen, bit), problem.potential(bit)))
+    return chosen
+
+
+def _swap(problem: _Problem, chosen: int, fixed=0) -> int:
+    """Replaces a mounted component with a better one, until no single swap helps"""
+    for _ in range(MAX_SWAP_ROUNDS):
+        improved = False
+        for out_bit in [b for b in problem.bits.values() if chosen & b and not fixed & b]:
+            rest = chosen & ~out_bit
+            loss = problem.loss(chosen, out_bit)
+            for in_bit in [b for b in problem.bits.values() if not chosen & b]:
+                if problem.gain(rest, in_bit) > loss:
+                    chosen, improved = rest | in_bit, True
+                    break
+            if improved:
+                break
+        if not improved:
+            break
+    return chosen
+
+
+def optimize_bar(recipes: Dict[str, Iterable[str]], candidates: Iterable[str], valves: int,
+                 weights: Dict[str, float] = None, keep: Iterable[str] = ()) -> BarPlan:
+    """
+    :param recipes: component names by recipe name
+    :param candidates: the component names available, e.g. the shelf
+    :param valves: how many components can be mounted
+    :param weights: recipe popularity, 1 for the recipes missing here
+    :param keep: the components to mount anyway, no more than the valves
+    """
+    keep = set(keep)
+    if len(keep) > valves:
+        raise ValueError('{} bottles to keep do not fit {} valves'.format(len(keep), valves))
+
+    problem = _Problem(recipes, weights or {}, candidates, valves)
+    fixed = 0
+    for component in keep:
+        fixed |= problem.bits.get(component, 0)
+
+    chosen = _swap(problem, _greedy(problem, valves, fixed), fixed)
+
+    plan = problem.plan(chosen)
+    logger.debug('Mounting %s makes %d recipes, scored %s', plan.components, len(plan.recipes), plan.score)
+    return plan
+
+
+def score_bar(recipes: Dict[str, Iterable[str]], components: Iterable[str], weights: Dict[str, float] = None):
+    """The plan of an already chosen bar, to compare against"""
+    components = list(components)
+    problem = _Problem(recipes, weights or {}, components, len(components))
+    return problem.plan(sum(problem.bits.values()))
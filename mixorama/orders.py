@@ -0,0 +1,206 @@
+"""An order queue in front of the Bartender: orders from the GUI, hardware buttons and CLI
+are accepted without blocking, and made one after another on a single worker thread."""
+import logging
+from collections import deque, OrderedDict
+from datetime import datetime
+from enum import Enum
+from threading import Condition, Event, Thread
+
+from mixorama.bartender import Bartender, BartenderState, CocktailAbortedException, OutOfComponent
+from mixorama.recipes import Component, Recipe
+
+logger = logging.getLogger(__name__)
+
+
+class OrderState(Enum):
+    QUEUED = 'queued'
+    MAKING = 'making'
+    SERVING = 'serving'
+    SERVED = 'served'
+    ABORTED = 'aborted'
+    CANCELLED = 'cancelled'
+
+
+class Order:
+    def __init__(self, recipe: Recipe, source='gui'):
+        self.recipe = recipe
+        self.source = source
+        self.state = OrderState.QUEUED
+        self.created_at = datetime.now()
+        self.reserved = OrderedDict()
+        ''':type: Dict[Component, int], ml set aside for the order and not poured yet'''
+        self._done = Event()
+
+    def wait(self, timeout=None):
+        """Blocks until the order is served, aborted or cancelled"""
+        self._done.wait(timeout)
+        return self.state
+
+    def finish(self, state: OrderState):
+        self.state = state
+        self._done.set()
+
+    @property
+    def volumes(self):
+        volumes = OrderedDict()
+        for component, volume in self.recipe:
+            volumes[component] = volumes.get(component, 0) + volume
+        return volumes
+
+    def __str__(self):
+        return '{} ({}, {})'.format(self.recipe.name, self.source, self.state.value)
+
+
+class OrderQueue:
+    def __init__(self, bartender: Bartender):
+        self.bartender = bartender
+        self.current = None
+        ''':type: Order'''
+        self.paused = False
+        self._orders = deque()
+        self._cond = Condition()
+        self._stopped = False
+        self._worker = None
+        self._prepared = False
+        bartender.on_sm_transitions(enum=BartenderState, MAKING=self._on_bartender_making)
+
+    def start(self):
+        if self._worker is None:
+            self._stopped = False
+            self._worker = Thread(target=self._run, name='order-queue', daemon=True)
+            self._worker.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self.current:
+            self.bartender.abort()
+
+    def submit(self, recipe: Recipe, source='gui') -> Order:
+        """Queues a drink, reserving its components; raises OutOfComponent if they are not available"""
+        order = Order(recipe, source)
+        with self._cond:
+            if not self._reserve(order):
+                raise OutOfComponent(recipe.name)
+
+            self._orders.append(order)
+            self.paused = False  # a new order means there is someone to take the glass
+            self._cond.notify_all()
+
+        logger.info('Queued %s, %d orders pending', order, len(self._orders))
+        return order
+
+    def cancel(self, order: Order):
+        with self._cond:
+            if order not in self._orders:
+                return False
+            self._orders.remove(order)
+            self._release(order)
+
+        order.finish(OrderState.CANCELLED)
+        return True
+
+    def abort(self):
+        """Aborts the drink being made or served, the rest of the queue proceeds"""
+        return self.bartender.abort()
+
+    def pending(self):
+        with self._cond:
+            return list(self._orders)
+
+    def __len__(self):
+        return len(self._orders)
+
+    def _reserve(self, order: Order):
+        volumes = order.volumes
+        if not all(c in self.bartender.components and c.can_reserve(v) for c, v in volumes.items()):
+            return False
+
+        for component, volume in volumes.items():
+            component.reserve(volume)
+        order.reserved = volumes
+        return True
+
+    def _release(self, order: Order, component: Component = None, volume=None):
+        """Releases the volume of the component, or the whole reservation of the order"""
+        for c in [component] if component else list(order.reserved):
+            reserved = order.reserved.pop(c, 0)
+            released = reserved if volume is None else min(volume, reserved)
+            c.release(released)
+            if reserved > released:
+                order.reserved[c] = reserved - released
+
+    def _on_bartender_making(self, component=None, volume=None, components=None):
+        """Releases the reservation of every pour as soon as the pour is used up, not when the drink is done,
+        so a new order is not turned down for the volume counted both as spent and as reserved"""
+        order = self.current
+        if order is None:
+            return
+        with self._cond:
+            if component and volume:
+                self._release(order, component, volume)
+            for c, v in (components or {}).items():
+                self._release(order, c, v)
+
+    def _unprepare(self):
+        self._prepared = False
+        self.bartender.unprepare()
+
+    def _next(self):
+        with self._cond:
+            while not self._stopped and (self.paused or not self._orders):
+                if self._prepared:  # the order it was prepared for is cancelled
+                    self._unprepare()
+                self._cond.wait()
+            if self._stopped:
+                return None
+            self._prepared = False  # making the drink pressurizes the bar anyway
+            return self._orders.popleft()
+
+    def _run(self):
+        while True:
+            order = self._next()
+            if order is None:
+                break
+
+            self.current = order
+            try:
+                self._make(order)
+            except Exception:
+                logger.exception('Unhandled exception making %s', order)
+                self._unprepare()
+                order.finish(OrderState.ABORTED)
+            finally:
+                self.current = None
+                if self.bartender._sm_state == BartenderState.ABORTED:
+                    self.bartender.discard()
+
+    def _make(self, order: Order):
+        order.state = OrderState.MAKING
+        try:
+            self.bartender.make_drink(recipe=order.recipe)
+        except CocktailAbortedException:
+            logger.info('Making %s was aborted', order)
+            order.finish(OrderState.ABORTED)
+            return
+        finally:
+            with self._cond:
+                self._release(order)  # whatever the aborted pours have not used
+
+        order.state = OrderState.SERVING
+        with self._cond:
+            upcoming = self._orders[0] if self._orders else None
+        if upcoming:
+            # while the user is taking the glass, get ready for the next one
+            self.bartender.prepare(upcoming.recipe)
+            self._prepared = True
+
+        try:
+            self.bartender.serve()
+            order.finish(OrderState.SERVED)
+        except CocktailAbortedException:
+            logger.info('%s was not taken, holding the queue until a new order comes', order)
+            self._unprepare()
+            self.paused = True
+            order.finish(OrderState.ABORTED)
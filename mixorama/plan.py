@@ -0,0 +1,91 @@
+"""Compiles recipes into pour plans: the steps the Bartender executes on a single tare of the glass."""
+from collections import OrderedDict
+from typing import Dict, List
+
+import attr
+
+from mixorama.flow import FlowModels
+from mixorama.recipes import Component, Recipe
+
+POURING_TIMEOUT_PER_ML = 400  # ms to push 1 ml, until the component's flow is learned
+
+
+@attr.s
+class PourStep:
+    components = attr.ib()
+    ''':type: Dict[Component, int]'''
+    start_weight = attr.ib()
+    ''':type: float, grams in the glass before the step'''
+    target_weight = attr.ib()
+    ''':type: float, grams in the glass after the step'''
+    timeout = attr.ib()
+    ''':type: float, ms'''
+
+    @property
+    def weight(self):
+        return self.target_weight - self.start_weight
+
+    @property
+    def parallel(self):
+        return len(self.components) > 1
+
+
+@attr.s
+class PourPlan:
+    recipe = attr.ib()
+    ''':type: Recipe'''
+    steps = attr.ib()
+    ''':type: List[PourStep]'''
+
+    @property
+    def weight(self):
+        return self.steps[-1].target_weight if self.steps else 0
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+
+def _group_parallel(recipe: Recipe, flow_models: FlowModels, parallel_pour):
+    """Groups the recipe into the components poured one at a time,
+    and the ones which can be poured together, at the place of the first of them"""
+    parallel = recipe.parallel if parallel_pour else False
+    group = OrderedDict()
+    groups = []
+    for component, volume in recipe:
+        if (parallel is True or component.name in (parallel or ())) and \
+                flow_models[component.name].pours:  # only calibrated flows can be split apart
+            if not group:
+                groups.append(group)
+            group[component] = group.get(component, 0) + volume
+        else:
+            groups.append(OrderedDict([(component, volume)]))
+    return groups
+
+
+def _pour_order(group: Dict[Component, int]):
+    # the parallel group first, as the longest step; then the denser liquids at the bottom
+    return len(group) == 1, -max(c.density for c in group)
+
+
+def _timeout(group: Dict[Component, int], flow_models: FlowModels):
+    return max(flow_models[c.name].timeout(volume * c.density) or volume * POURING_TIMEOUT_PER_ML
+               for c, volume in group.items())
+
+
+def compile_plan(recipe: Recipe, flow_models: FlowModels, parallel_pour=False, dense_first=False) -> PourPlan:
+    """:param dense_first: reorder the steps, unless the recipe keeps its order, see _pour_order()"""
+    groups = _group_parallel(recipe, flow_models, parallel_pour)
+    if dense_first and not recipe.keep_order:
+        groups.sort(key=_pour_order)
+
+    steps = []
+    weight = 0
+    for group in groups:
+        step_weight = sum(volume * c.density for c, volume in group.items())
+        steps.append(PourStep(group, weight, weight + step_weight, _timeout(group, flow_models)))
+        weight += step_weight
+
+    return PourPlan(recipe, steps)
@@ -1,29 +1,59 @@
+from types import MappingProxyType
+from typing import Any, List, Mapping, Optional, Union
+
+
 class Component:
-    name = 'Weird Ingridient'
+    __slots__ = ('name', 'density', 'strength', 'volume', 'spent', 'reserved', 'listeners')
 
     def __init__(self, name=None, density=1, strength=0, volume=1000):
         """
         :param density: grams per milliliter
         :param strength: ABV, %
         """
+        self.name = name or 'Weird Ingridient'
         self.density = density
         self.strength = strength
         self.volume = volume
         self.spent = 0
-        if name:
-            self.name = name
+        self.reserved = 0
+        self.listeners = []
+
+    def on_change(self, callback):
+        """Calls callback(component, event, volume) after every use or fill changing the level"""
+        self.listeners.append(callback)
+
+    def _changed(self, event, volume):
+        for callback in self.listeners:
+            callback(self, event, volume)
 
     def use(self, volume_used):
         can_use = self.can_use(volume_used)
         if can_use:
             self.spent += volume_used
+            self._changed('use', volume_used)
         return can_use
 
     def can_use(self, volume):
         return self.volume > self.spent + volume
 
+    def can_reserve(self, volume):
+        return self.can_use(self.reserved + volume)
+
+    def reserve(self, volume):
+        """Sets the volume aside for a queued drink, until it's released"""
+        can_reserve = self.can_reserve(volume)
+        if can_reserve:
+            self.reserved += volume
+        return can_reserve
+
+    def release(self, volume):
+        self.reserved = max(self.reserved - volume, 0)
+
     def fill(self, value=None):
-        self.spent = self.volume - (self.volume if value is None else value)
+        spent = self.volume - (self.volume if value is None else value)
+        if spent != self.spent:
+            self.spent = spent
+            self._changed('fill', self.volume - spent)
         return self.spent < self.volume
 
     def __str__(self):
@@ -31,30 +61,57 @@ class Component:
 
 
 class Recipe:
-    name = 'Mystery Booze'
-    sequence = []
-    ''':type: List[Tuple[Component, int]]'''
-    image = None
-    ''':type: str'''
-    description = None
-    ''':type: str'''
-
-    def __init__(self, name=None, sequence=None, **meta):
-        self.sequence = sequence or []
-        if name:
-            self.name = name
-        for k, v in meta.items():
-            setattr(self, k, v)
+    """An immutable recipe, its volume, weight and strength are computed once"""
+
+    __slots__ = ('name', 'sequence', 'meta', '_volume', '_weight', '_strength')
+
+    def __init__(self, name=None, sequence=None, meta: Mapping[str, Any] = None):
+        """
+        :param sequence: (component, ml) pairs
+        :param meta: image, description, parallel, keep_order and whatever else the menu has to say
+        """
+        sequence = tuple((c, v) for c, v in sequence or ())
+        volume = sum(v for _, v in sequence)
+        init = super().__setattr__
+        init('name', name or 'Mystery Booze')
+        init('sequence', sequence)
+        ''':type: Tuple[Tuple[Component, int], ...]'''
+        init('meta', MappingProxyType(dict(meta or {})))
+        init('_volume', volume)
+        init('_weight', sum(v * c.density for c, v in sequence))
+        init('_strength', sum(v * c.strength for c, v in sequence) / volume if volume else 0)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('{} is immutable'.format(type(self).__name__))
+
+    def __delattr__(self, key):
+        raise AttributeError('{} is immutable'.format(type(self).__name__))
+
+    @property
+    def image(self) -> Optional[str]:
+        return self.meta.get('image')
+
+    @property
+    def description(self) -> Optional[str]:
+        return self.meta.get('description')
+
+    @property
+    def parallel(self) -> Union[bool, List[str]]:
+        return self.meta.get('parallel', False)
+
+    @property
+    def keep_order(self) -> bool:
+        """Pour in the given order even if the bartender reorders by density, e.g. for layered drinks"""
+        return self.meta.get('keep_order', False)
 
     def volume(self):
-        return sum([component[1] for component in self.sequence])
+        return self._volume
 
     def weight(self):
-        return sum([c[1] * c[0].density for c in self.sequence])
+        return self._weight
 
     def strength(self):
-        return sum([c[1] * c[0].strength for c in self.sequence]) \
-               / self.volume()
+        return self._strength
 
     def __iter__(self):
         return iter(self.sequence)
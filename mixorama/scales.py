@@ -1,17 +1,51 @@
+import asyncio
 import logging
 import os
-from multiprocessing import Queue
-from threading import Thread, Event
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from itertools import islice
+from threading import Thread, Event, Condition
 from random import randint
 import statistics
+import struct
+from binascii import crc_hqx
 
 from serial import Serial
 
-from mixorama.util import make_timeout
+from mixorama.filters import SampleFilter, create_filter
+from mixorama.metrics import LATENCY_BUCKETS, REGISTRY
+from mixorama.util import make_timeout, now, sleep
 
 SCALES_RESET_TIMEOUT = 5000
+SAMPLE_BUFFER_SIZE = 256  # samples, ~23 seconds of the firmware's 90ms cadence
+SAMPLE_TIMEOUT = 2  # sec, how long a subscriber waits for a single fresh sample
+READER_RETRY_DELAY = 1  # sec, backoff after a failing port read
+MOCK_SAMPLE_INTERVAL = 0.01  # sec
+
+PROTOCOL_ASCII = 'ascii'
+PROTOCOL_BINARY = 'binary'
+BINARY_BAUDRATE = 115200
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_PAYLOAD = struct.Struct('<HIf')  # sample counter, device millis, raw reading
+FRAME_CRC = struct.Struct('<H')
+FRAME_SIZE = len(FRAME_SYNC) + FRAME_PAYLOAD.size + FRAME_CRC.size
+MAX_LINE = 64  # bytes, a longer ascii line is garbage
 logger = logging.getLogger(__name__)
 
+SAMPLE_INTERVALS = REGISTRY.histogram(
+    'mixorama_scales_sample_interval_seconds', 'Between the arrivals of the consecutive samples',
+    buckets=(.01, .025, .05, .075, .09, .1, .125, .15, .2, .3, .5, 1, 2))
+DECISION_LATENCY = REGISTRY.histogram(
+    'mixorama_scales_decision_latency_seconds', 'From the arrival of a sample to a wait for weight acting on it',
+    buckets=LATENCY_BUCKETS)
+PARSE_ERRORS = REGISTRY.counter(
+    'mixorama_scales_parse_errors', 'Unparseable lines and corrupt frames from the scales', ['protocol'])
+DROPPED_SAMPLES = REGISTRY.counter(
+    'mixorama_scales_dropped_samples', 'Binary frames lost on the serial link, by the gaps in their counters')
+READ_TIMEOUTS = REGISTRY.counter('mixorama_scales_read_timeouts', 'The scales sending no data in time')
+BUFFER_OVERRUNS = REGISTRY.counter(
+    'mixorama_scales_buffer_overruns', 'Samples overwritten in the sample buffer before a subscriber read them')
+
 
 class ScalesException(Exception):
     pass
@@ -25,45 +59,206 @@ class WaitingForWeightAbortedException(ScalesException):
     pass
 
 
+Frame = namedtuple('Frame', ['counter', 'device_time', 'value'])
+
+
+class FrameDecoder:
+    """Incremental decoder of the hx711-serial binary frames.
+
+    A frame is FRAME_SYNC, a little-endian payload of
+    (uint16 sample counter, uint32 device millis, float32 raw reading)
+    and a CRC-16/CCITT-FALSE of the payload."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._last_counter = None
+        self.crc_errors = 0
+        self.dropped = 0
+
+    def reset(self):
+        del self._buf[:]
+        self._last_counter = None
+
+    def feed(self, data):
+        buf = self._buf
+        buf += data
+        frames = []
+        start = 0
+
+        with memoryview(buf) as view:  # the payloads are checked in place, the buffer is trimmed once
+            while True:
+                sync = buf.find(FRAME_SYNC, start)
+                if sync < 0:
+                    # the last byte may be the beginning of a sync, unless it's the end of a decoded frame
+                    start = max(start, len(buf) - 1)
+                    break
+                start = sync
+
+                if len(buf) - start < FRAME_SIZE:
+                    break
+
+                payload_start = start + len(FRAME_SYNC)
+                payload_end = payload_start + FRAME_PAYLOAD.size
+                crc, = FRAME_CRC.unpack_from(buf, payload_end)
+                if crc_hqx(view[payload_start:payload_end], 0xFFFF) != crc:
+                    self.crc_errors += 1
+                    PARSE_ERRORS.inc(protocol=PROTOCOL_BINARY)
+                    start += 1
+                    continue
+
+                frame = Frame(*FRAME_PAYLOAD.unpack_from(buf, payload_start))
+                start += FRAME_SIZE
+
+                if self._last_counter is not None:
+                    dropped = (frame.counter - self._last_counter - 1) & 0xFFFF
+                    if dropped:
+                        self.dropped += dropped
+                        DROPPED_SAMPLES.inc(dropped)
+                self._last_counter = frame.counter
+                frames.append(frame)
+
+        if start > 0:
+            del buf[:start]
+        return frames
+
+
+class LineDecoder:
+    """Incremental parser of the hx711-serial ascii lines: a raw reading per line, '#' starting a comment.
+
+    Whatever bytes are available are fed at once into a reusable buffer and the complete lines
+    are parsed without decoding them into strings; the consumed bytes are dropped once per feed.
+    Each line is still copied out of the buffer once, as float() takes neither a memoryview nor an offset."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self.errors = 0
+
+    def reset(self):
+        del self._buf[:]
+
+    def feed(self, data, values: deque):
+        """Appends the readings of the complete lines to the values"""
+        buf = self._buf
+        buf += data
+        start = 0
+        end = buf.find(b'\n')
+        while end >= 0:
+            if end > start and buf[start] not in (0x23, 0x0d):  # not a '#' comment, nor an empty line
+                try:
+                    values.append(float(buf[start:end]))  # float() skips the '\r' and the spaces
+                except ValueError:
+                    self._error(buf[start:end])
+            start = end + 1
+            end = buf.find(b'\n', start)
+
+        if len(buf) - start > MAX_LINE:
+            self._error(buf[start:])
+            start = len(buf)
+        if start:
+            del buf[:start]
+
+    def _error(self, line):
+        self.errors += 1
+        PARSE_ERRORS.inc(protocol=PROTOCOL_ASCII)
+        logger.warning('could not parse received data: %r', bytes(line))
+
+
 class ScalesImpl:
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, protocol=PROTOCOL_ASCII, binary_baudrate=BINARY_BAUDRATE, **kwargs):
         self.port = Serial(**kwargs)
+        self.protocol = protocol
+        self.ascii_baudrate = self.port.baudrate
+        self.binary_baudrate = binary_baudrate
+        self.binary = False
+        self.decoder = FrameDecoder()
+        self.lines = LineDecoder()
+        self._pending = deque()
 
     def reset(self):
         logger.debug('scales reset()')
 
         if not self.port.is_open:
+            self.port.baudrate = self.ascii_baudrate
+            self.binary = False
             self.port.open()
             logger.debug('port open')
 
+        if self.protocol == PROTOCOL_BINARY and not self.binary:
+            self.binary = self._negotiate_binary()
+
         self.port.flushInput()
+        self.decoder.reset()
+        self.lines.reset()
+        self._pending.clear()
         logger.debug('reset() complete')
 
+    def _negotiate_binary(self):
+        self.port.flushInput()
+        self.port.write(b'b%d\n' % self.binary_baudrate)
+
+        timeout = make_timeout(self.port.timeout * 1000)
+        while not timeout():
+            if self.port.readline().startswith(b'#binary'):
+                self.port.baudrate = self.binary_baudrate
+                logger.info('scales switched to binary frames at %d baud', self.binary_baudrate)
+                return True
+
+        # the firmware may be still streaming frames since our previous run
+        self.port.baudrate = self.binary_baudrate
+        self.port.flushInput()
+        if self.decoder.feed(self.port.read(FRAME_SIZE * 3)):
+            logger.info('scales are already streaming binary frames at %d baud', self.binary_baudrate)
+            return True
+
+        logger.warning('scales firmware did not acknowledge binary frames, falling back to ascii')
+        self.port.baudrate = self.ascii_baudrate
+        return False
+
     def get_raw_data(self, n):
-        data = []
         if not self.port.is_open:
             self.port.open()
             logger.debug('port open')
 
-        timeout = make_timeout(self.port.timeout * 1000)
-        while len(data) < n:
-            if timeout():
-                raise ScalesTimeoutException('could not get raw data')
+        if self.binary:
+            return self._get_binary_data(n)
+        return self._get_ascii_data(n)
 
-            raw_data = self.port.readline()
-            logger.debug('get_data_raw() rcv: %s', raw_data)
+    def _get_binary_data(self, n):
+        pending = self._pending
+        if len(pending) < n:
+            deadline = now() + self.port.timeout
+            while len(pending) < n:
+                if now() > deadline:
+                    self.binary = False  # renegotiate on the next reset()
+                    raise ScalesTimeoutException('could not get a binary frame')
 
-            try:
-                raw_line = raw_data.decode('ascii')
-                if raw_line.startswith('#'):
-                    continue
+                chunk = self.port.read(self.port.in_waiting or 1)
+                pending.extend(frame.value for frame in self.decoder.feed(chunk))
+
+        return [pending.popleft() for _ in range(n)]
+
+    def _get_ascii_data(self, n):
+        """The buffered readings first, the port is read only when they run out"""
+        pending = self._pending
+        if len(pending) < n:
+            deadline = now() + self.port.timeout
+            while len(pending) < n:
+                if now() > deadline:
+                    raise ScalesTimeoutException('could not get raw data')
 
-                data.append(float(raw_line))
-            except ValueError:
-                logger.exception('could not parse received data')
-        return data
+                chunk = self.port.read(self.port.in_waiting or 1)  # one read() per chunk, not per byte
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('get_data_raw() rcv: %r', chunk)
+                self.lines.feed(chunk, pending)
+
+        return [pending.popleft() for _ in range(n)]
 
     def stop(self):
+        if self.binary and self.port.is_open:
+            self.port.write(b'a')  # back to ascii, so that the next start negotiates again
+            self.port.flush()
+            self.binary = False
+
         logger.debug('port closed')
         self.port.close()
 
@@ -81,6 +276,7 @@ class MockScalesImpl:
         window = []
 
         for _ in range(n):
+            sleep(MOCK_SAMPLE_INTERVAL)
             v = self.counter - randint(50, 100)
             window.append(v)
 
@@ -91,91 +287,400 @@ class MockScalesImpl:
         pass
 
 
-def reject_outliers(data, stdev_multiplier=2):
-    m = statistics.mean(data)
-    s = statistics.stdev(data)
-    filtered = [e for e in data if (m - stdev_multiplier * s < e < m + stdev_multiplier * s)]
-    return filtered
+Sample = namedtuple('Sample', ['seq', 'timestamp', 'value', 'raw'])
+
+
+class SampleBuffer:
+    """A fixed-size ring buffer of timestamped raw samples.
+
+    Filled by a single ScalesReader, read by any number of SampleSubscriptions."""
+
+    def __init__(self, size=SAMPLE_BUFFER_SIZE):
+        self._samples = deque(maxlen=size)
+        self._cond = Condition()
+        self._waiters = []
+        ''':type: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]'''
+        self.seq = 0
+        self.source = None
+        ''':type: Callable[[], None], pushes a sample whenever a subscriber would wait, e.g. a simulator'''
+
+    def push(self, value, timestamp=None, raw=None):
+        """
+        :param value: the filtered sample
+        :param raw: the sample as received, if different
+        """
+        timestamp = timestamp or now()
+        with self._cond:
+            if self._samples:
+                SAMPLE_INTERVALS.observe(timestamp - self._samples[-1].timestamp)
+            self.seq += 1
+            self._samples.append(Sample(self.seq, timestamp, value, value if raw is None else raw))
+            self._cond.notify_all()
+            self._wake_waiters()
+
+    def wake(self):
+        """Wakes up all the waiting subscribers without giving them a sample"""
+        with self._cond:
+            self._cond.notify_all()
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        for loop, future in self._waiters:
+            loop.call_soon_threadsafe(_set_done, future)
+        del self._waiters[:]
+
+    def latest(self):
+        with self._cond:
+            return self._samples[-1] if self._samples else None
+
+    def wait(self, seq, timeout=None):
+        """Returns the samples newer than seq, waiting up to timeout seconds if there are none yet"""
+        with self._cond:
+            if self.seq <= seq:
+                if self.source is not None:
+                    self.source()
+                else:
+                    self._cond.wait(timeout)
+            return self._since(seq)
+
+    async def wait_async(self, seq, timeout=None):
+        """An awaitable wait(), for the coroutines of an event loop"""
+        loop = asyncio.get_event_loop()
+        with self._cond:
+            pulled = self.seq <= seq and self.source is not None
+            if pulled:
+                self.source()
+        if pulled:
+            # a source pulls without ever suspending the coroutine, the cancellations and other tasks need a turn
+            await asyncio.sleep(0)
+
+        with self._cond:
+            if self.seq > seq:
+                return self._since(seq)
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+
+        # not asyncio.wait_for(), which may swallow a cancellation coinciding with a sample
+        timer = loop.call_later(timeout, _set_done, future) if timeout is not None else None
+        try:
+            await future
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self._cond:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+
+        with self._cond:
+            return self._since(seq)
+
+    def _since(self, seq):
+        if self.seq - seq > len(self._samples):
+            BUFFER_OVERRUNS.inc(self.seq - seq - len(self._samples))
+        newer = min(self.seq - seq, len(self._samples))
+        if newer <= 0:
+            return []
+        return list(islice(self._samples, len(self._samples) - newer, None))
+
+    def subscribe(self):
+        return SampleSubscription(self)
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SampleSubscription:
+    """A reading cursor into a SampleBuffer, starting at the moment of subscription"""
+
+    def __init__(self, buffer: SampleBuffer):
+        self.buffer = buffer
+        self.seq = buffer.seq
+        self.timestamp = None  # of the latest sample read
+
+    def wait(self, timeout=None):
+        samples = self.buffer.wait(self.seq, timeout)
+        if samples:
+            self.seq = samples[-1].seq
+            self.timestamp = samples[-1].timestamp
+        return samples
+
+    def read(self, n, timeout=SAMPLE_TIMEOUT, abort: Event = None):
+        """Returns the values of n fresh samples"""
+        values = []
+        deadline = now() + timeout
+        while len(values) < n:
+            if abort is not None and abort.is_set():
+                raise WaitingForWeightAbortedException()
+            if now() > deadline:
+                raise ScalesTimeoutException('could not get raw data')
+
+            samples = self.wait(timeout)
+            if samples:
+                values.extend(sample.value for sample in samples)
+                deadline = now() + timeout
+
+        return values[-n:]
+
+    async def wait_async(self, timeout=None):
+        samples = await self.buffer.wait_async(self.seq, timeout)
+        if samples:
+            self.seq = samples[-1].seq
+            self.timestamp = samples[-1].timestamp
+        return samples
+
+    async def read_async(self, n, timeout=SAMPLE_TIMEOUT):
+        """Awaits the values of n fresh samples, a cancellation aborts the waiting"""
+        values = []
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        try:
+            while len(values) < n:
+                if loop.time() > deadline:
+                    raise ScalesTimeoutException('could not get raw data')
+
+                samples = await self.wait_async(deadline - loop.time())
+                if samples:
+                    values.extend(sample.value for sample in samples)
+                    deadline = loop.time() + timeout
+        except asyncio.CancelledError as e:
+            raise WaitingForWeightAbortedException() from e
+
+        return values[-n:]
+
+
+class ScalesReader(Thread):
+    """Owns the scales port for the whole process, streaming its samples into a SampleBuffer"""
+
+    def __init__(self, impl, buffer: SampleBuffer, sample_filter: SampleFilter = None):
+        super().__init__(name='scales-reader', daemon=True)
+        self.impl = impl
+        self.buffer = buffer
+        self.filter = sample_filter or SampleFilter()
+        self._stop_event = Event()
+
+    def run(self):
+        logger.debug('started scales reader')
+        while not self._stop_event.is_set():
+            try:
+                self.impl.reset()
+                self.filter.reset()
+                while not self._stop_event.is_set():
+                    for raw in self.impl.get_raw_data(1):
+                        timestamp = now()
+                        self.buffer.push(self.filter.update(raw, timestamp), timestamp, raw)
+            except ScalesTimeoutException:
+                READ_TIMEOUTS.inc()
+                logger.warning('scales did not send any data in time')
+            except Exception:
+                logger.exception('scales reader failed, retrying')
+                self._stop_event.wait(READER_RETRY_DELAY)
+
+        self.impl.stop()
+        logger.debug('stopped scales reader')
+
+    def stop(self):
+        self._stop_event.set()
 
 
 class Scales:
     tare = 0
-
-    def __init__(self, calibrated_1g=-2000.0, measurements=1, **kwargs):
+    decided_at = None
+    ''':type: float, the arrival of the sample the latest wait for weight acted on'''
+
+    def __init__(self, calibrated_1g=-2000.0, measurements=1, buffer_size=SAMPLE_BUFFER_SIZE, filter=None,
+                 impl=None, **kwargs):
+        """
+        :param filter: the sample filter config, e.g. {'type': 'kalman'}, see mixorama.filters
+        :param impl: the scales backend, instead of the serial port, e.g. a mixorama.simulator.Simulator
+        """
         self._abort_event = Event()
         self.calibrated_1g = calibrated_1g
         self.measurements = measurements
-
-        if 'MOCK_SCALES' in os.environ:
+        self.sample_timeout = kwargs.get('timeout') or SAMPLE_TIMEOUT
+        self.buffer = SampleBuffer(buffer_size)
+        self.filter = create_filter(**(filter or {}))
+        self._reader = None
+        self._listeners = []
+
+        if impl is not None:
+            self.scales = impl
+        elif 'MOCK_SCALES' in os.environ:
             logger.warning('Using mocked scales!')
             self.scales = MockScalesImpl()
         else:
             self.scales = ScalesImpl(**kwargs)
 
+    def start(self):
+        if getattr(self.scales, 'on_demand', False):
+            if self.buffer.source is None:
+                self.scales.reset()
+                self.filter.reset()
+                self.buffer.source = self._pull
+            return
+        if self._reader is None or not self._reader.is_alive():
+            self._reader = ScalesReader(self.scales, self.buffer, self.filter)
+            self._reader.start()
+
+    def _pull(self):
+        for raw in self.scales.get_raw_data(1):
+            timestamp = now()
+            self.buffer.push(self.filter.update(raw, timestamp), timestamp, raw)
+
+    def stop(self):
+        if self.buffer.source is not None:
+            self.buffer.source = None
+            self.scales.stop()
+        if self._reader is not None:
+            self._reader.stop()
+            self._reader.join(self.sample_timeout)
+            self._reader = None
+
+    @property
+    def velocity(self):
+        """gr/sec, if the filter estimates it"""
+        return self.filter.velocity / self.calibrated_1g if self.filter.velocity is not None else None
+
+    def subscribe(self) -> SampleSubscription:
+        self.start()
+        return self.buffer.subscribe()
+
+    def latest_weight(self):
+        """The weight of the latest sample, if it's fresh, without waiting for one"""
+        self.start()
+        if self.buffer.source is not None:
+            self.buffer.source()
+        sample = self.buffer.latest()
+        if sample is None or now() - sample.timestamp > self.sample_timeout:
+            return None
+        return self._weight(sample.value)
+
+    def on_operation(self, callback):
+        """Calls callback(operation, started, duration, outcome) after every reset and wait for weight,
+        the outcome being 'ok', 'timeout', 'aborted' or 'error'"""
+        self._listeners.append(callback)
+
+    @contextmanager
+    def _operation(self, name):
+        if not self._listeners:
+            yield
+            return
+
+        started = now()
+        outcome = 'ok'
+        try:
+            yield
+        except ScalesTimeoutException:
+            outcome = 'timeout'
+            raise
+        except (WaitingForWeightAbortedException, asyncio.CancelledError):
+            outcome = 'aborted'
+            raise
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            for callback in self._listeners:
+                try:
+                    callback(name, started, now() - started, outcome)
+                except Exception:
+                    logger.exception('Scales operation listener failed')
+
     def reset(self, tare=None, stabilize=True):
-        self.scales.reset()
-        if stabilize:
-            self._raw_measure(6)  # skipping some data to stabilize
-        self.tare = tare or self._raw_measure()
+        with self._operation('reset'):
+            samples = self.subscribe()
+            if stabilize:
+                self._raw_measure(6, samples)  # skipping some data to stabilize
+            self.tare = tare or self._raw_measure(samples=samples)
         logger.info('set tare to %f', self.tare)
 
-    def _raw_measure(self, measurements=None):
-        measures = self.scales.get_raw_data(measurements or self.measurements)
-        mean = statistics.mean(measures)
-        #logger.debug('mean measurements: %f', mean)
-        return mean
+    async def reset_async(self, tare=None, stabilize=True):
+        with self._operation('reset'):
+            samples = self.subscribe()
+            if stabilize:
+                await self._raw_measure_async(6, samples)  # skipping some data to stabilize
+            self.tare = tare or await self._raw_measure_async(samples=samples)
+        logger.info('set tare to %f', self.tare)
 
-    def measure(self, autostop=False):
-        try:
-            no_tare = self._raw_measure() - self.tare
-            #logger.debug('no_tare: %f', no_tare)
+    async def _raw_measure_async(self, measurements=None, samples: SampleSubscription = None):
+        samples = samples or self.subscribe()
+        measures = await samples.read_async(measurements or self.measurements, self.sample_timeout)
+        return statistics.mean(measures)
 
-            weight_in_gr = no_tare / self.calibrated_1g
-            #logger.debug('weight_in_gr: %f', weight_in_gr)
+    async def measure_async(self, samples: SampleSubscription = None):
+        return self._weight(await self._raw_measure_async(samples=samples))
 
-            return weight_in_gr
+    async def wait_for_weight_async(self, target, timeout=20000, on_progress=lambda d, s: None, until=None):
+        """An awaitable wait_for_weight(), which is aborted by cancelling it"""
+        samples = self.subscribe()
+        time_is_out = make_timeout(timeout)
+        until = until or (lambda v, t: v > target if target > 0 else v < target)
 
-        except TimeoutError as e:
-            raise ScalesTimeoutException from e
-        finally:
-            if autostop:
-                self.scales.stop()
+        logger.info('waiting for a target weight of %f', target)
+        with self._operation('wait'):
+            v = await self.measure_async(samples)
+            while not until(v, self._deciding(samples)):
+                if time_is_out():
+                    raise ScalesTimeoutException(v)
 
-    def wait_for_weight(self, target, timeout=20000, on_progress=lambda d, s: None):
-        self._abort_event.clear()
-        result_queue = Queue()
+                v = await self.measure_async(samples)
+                logger.debug('got measurement: %f', v)
+                on_progress(min(v, target), target)
 
-        def poller():
-            logger.debug('started scales poller')
-            time_is_out = make_timeout(timeout)
-            try:
-                v = self.measure()
-                while not (v > target if target > 0 else v < target):
-                    if self._abort_event.is_set():
-                        return result_queue.put(WaitingForWeightAbortedException())
+        return v
 
-                    if time_is_out():
-                        return result_queue.put(ScalesTimeoutException(v))
+    def _deciding(self, samples: SampleSubscription):
+        """The arrival of the latest sample read, noting how stale it is for the decision about to be made"""
+        self.decided_at = samples.timestamp
+        DECISION_LATENCY.observe(now() - self.decided_at)
+        return self.decided_at
 
-                    v = self.measure()
-                    logger.debug('got measurement: %f', v)
-                    on_progress(min(v, target), target)
+    def _weight(self, raw):
+        no_tare = raw - self.tare
+        #logger.debug('no_tare: %f', no_tare)
 
-                result_queue.put(v)
-            except Exception as e:
-                result_queue.put(e)
-                raise
+        weight_in_gr = no_tare / self.calibrated_1g
+        #logger.debug('weight_in_gr: %f', weight_in_gr)
 
-        Thread(target=poller, daemon=True).start()
+        return weight_in_gr
+
+    def _raw_measure(self, measurements=None, samples: SampleSubscription = None, abort: Event = None):
+        samples = samples or self.subscribe()
+        measures = samples.read(measurements or self.measurements, self.sample_timeout, abort)
+        mean = statistics.mean(measures)
+        #logger.debug('mean measurements: %f', mean)
+        return mean
+
+    def measure(self, samples: SampleSubscription = None, abort: Event = None):
+        return self._weight(self._raw_measure(samples=samples, abort=abort))
+
+    def wait_for_weight(self, target, timeout=20000, on_progress=lambda d, s: None, until=None):
+        """Waits until the target weight is reached
+
+        :param until: callable(weight, timestamp) deciding that the wait is over instead of the target weight
+        """
+        self._abort_event.clear()
+        samples = self.subscribe()
+        time_is_out = make_timeout(timeout)
+        until = until or (lambda v, t: v > target if target > 0 else v < target)
 
         logger.info('waiting for a target weight of %f', target)
-        result = result_queue.get(block=True)
+        with self._operation('wait'):
+            v = self.measure(samples, self._abort_event)
+            while not until(v, self._deciding(samples)):
+                if self._abort_event.is_set():
+                    raise WaitingForWeightAbortedException()
+
+                if time_is_out():
+                    raise ScalesTimeoutException(v)
 
-        self.scales.stop()
-        if isinstance(result, Exception):
-            raise result
+                v = self.measure(samples, self._abort_event)
+                logger.debug('got measurement: %f', v)
+                on_progress(min(v, target), target)
 
-        return result
+        return v
 
     def abort_waiting_for_weight(self):
         self._abort_event.set()
+        self.buffer.wake()
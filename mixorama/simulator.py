@@ -0,0 +1,143 @@
+"""A scales backend simulating the glass under the bar's valves, for the tests, the tuning and the benchmarks.
+
+The flows follow the actual Valve and compressor states: the compressor builds up the pressure in the
+bottles, an open valve pushes its component at its flow rate times the pressure, and the poured liquid
+lands in the glass after the line inertia. A customer lifts the glass once the drink has been idle for
+a while and puts an empty one in its place. Every sample advances the clock, so on a VirtualClock the
+simulation runs as fast as the samples are consumed."""
+import logging
+import math
+import random
+from typing import Dict
+
+from mixorama import util
+from mixorama.io import Valve
+from mixorama.recipes import Component
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.1  # sec, the HX711 at 10 samples per second
+DEFAULT_FLOW_RATE = 10  # ml/sec at full pressure
+PRESSURE_TIME = 0.3  # sec, the time constant of the compressor building up the pressure
+LINE_INERTIA = 0.4  # sec, the time constant of the poured liquid landing in the glass
+NOISE = 0.3  # gr, standard deviation of the sensor noise
+SIM_GLASS_WEIGHT = 200  # gr
+SERVE_DELAY = 5  # sec of no pouring after which the customer takes the glass
+GLASS_DELAY = SAMPLE_INTERVAL  # sec until the next empty glass is put on the scales
+IDLE_FLOW = 0.05  # gr in flight, below which nothing is being poured
+
+
+class SimulatedValve(Valve):
+    """A valve the simulator reads, never touching the GPIO: nothing is poured for real"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+
+class Simulator:
+    on_demand = True  # the samples are made when asked for, see Scales.start()
+
+    def __init__(self, bar: Dict[Component, Valve], compressor: Valve, calibrated_1g=-2000.0,
+                 sample_interval=SAMPLE_INTERVAL, flow_rates: Dict[str, float] = None,
+                 default_flow_rate=DEFAULT_FLOW_RATE, pressure_time=PRESSURE_TIME, line_inertia=LINE_INERTIA,
+                 noise=NOISE, glass_weight=SIM_GLASS_WEIGHT, serve_delay=SERVE_DELAY, glass_delay=GLASS_DELAY,
+                 seed=None):
+        """
+        :param flow_rates: ml/sec at full pressure by component name
+        """
+        self.bar = bar
+        self.compressor = compressor
+        self.calibrated_1g = calibrated_1g
+        self.sample_interval = sample_interval
+        self.flow_rates = {c: (flow_rates or {}).get(c.name, default_flow_rate) for c in bar}
+        self.pressure_time = pressure_time
+        self.line_inertia = line_inertia
+        self.noise = noise
+        self.glass_weight = glass_weight
+        self.serve_delay = serve_delay
+        self.glass_delay = glass_delay
+        self.random = random.Random(seed)
+
+        self.time = None
+        self.pressure = 0.0
+        ''':type: float, 0..1 of the full pressure'''
+        self.in_flight = 0.0
+        ''':type: float, gr poured, but not yet in the glass'''
+        self.poured = {c: 0.0 for c in bar}
+        ''':type: Dict[Component, float], ml poured so far by component'''
+        self.glass = True
+        self.content = 0.0
+        ''':type: float, gr in the glass'''
+        self.idle_since = None
+        self.lifted_at = None
+        self.served = 0
+
+    def reset(self):
+        self.time = util.now()
+
+    def stop(self):
+        pass
+
+    def get_raw_data(self, n):
+        window = []
+        for _ in range(n):
+            util.sleep(self.sample_interval)
+            self._advance_to(util.now())
+            noise = self.random.gauss(0, self.noise)
+            window.append((self.weight() + noise) * self.calibrated_1g)
+        return window
+
+    def weight(self):
+        """gr on the scales, without the noise"""
+        return self.glass_weight + self.content if self.glass else 0
+
+    def _advance_to(self, until):
+        if self.time is None:
+            self.time = until
+        while self.time < until:
+            dt = min(self.sample_interval, until - self.time)
+            self._step(dt)
+            self.time += dt
+
+    def _step(self, dt):
+        target_pressure = 1.0 if self.compressor.is_open else 0.0
+        self.pressure += (target_pressure - self.pressure) * (1 - math.exp(-dt / self.pressure_time))
+
+        pouring = False
+        for component, valve in self.bar.items():
+            if valve.is_open and self.pressure > 0:
+                volume = self.flow_rates[component] * self.pressure * dt
+                self.poured[component] += volume
+                self.in_flight += volume * component.density
+                pouring = True
+
+        landed = self.in_flight * (1 - math.exp(-dt / self.line_inertia))
+        self.in_flight -= landed
+        if self.glass:
+            self.content += landed
+
+        self._customer(pouring)
+
+    def _customer(self, pouring):
+        if not self.glass:
+            if self.time - self.lifted_at >= self.glass_delay:
+                self.glass = True
+                self.content = 0.0
+            return
+
+        if pouring or self.in_flight > IDLE_FLOW or not self.content:
+            self.idle_since = None
+        elif self.idle_since is None:
+            self.idle_since = self.time
+        elif self.time - self.idle_since >= self.serve_delay:
+            logger.debug('The customer takes a glass of %.1f gr', self.content)
+            self.glass = False
+            self.lifted_at = self.time
+            self.idle_since = None
+            self.served += 1
@@ -1,6 +1,13 @@
-from collections import defaultdict
+import asyncio
+import inspect
+import logging
+from collections import namedtuple, OrderedDict
 from enum import Enum
-from typing import Union
+from functools import wraps
+from threading import Lock
+from typing import Dict, Union
+
+logger = logging.getLogger(__name__)
 
 
 class CoreStates(Enum):
@@ -15,6 +22,9 @@ class InvalidStateMachineTransition(AttributeError):
             operation, current_state, allowed_states))
 
 
+SmTransition = namedtuple('SmTransition', ['allowed_from', 'when_done', 'while_working', 'on_exception'])
+
+
 def sm_transition(allowed_from: Union[list, Enum],
                   when_done: Enum,
                   while_working: Enum = None,
@@ -22,43 +32,102 @@ def sm_transition(allowed_from: Union[list, Enum],
 
     allowed_from = [allowed_from] if not type(allowed_from) in (tuple, list) else allowed_from
     on_exception = on_exception or CoreStates.EXCEPTION
+    transition = SmTransition(frozenset(allowed_from), when_done, while_working, on_exception)
+    allowed_states = transition.allowed_from
 
     def decorate(f):
-        def check_transition_and_run(self, *args, **kwargs):
-            operation_name = f.__name__
+        operation_name = f.__name__
+
+        def enter(self, args, kwargs):
             current_state = getattr(self, '_sm_state', CoreStates.UNDEFINED)
 
-            if current_state not in allowed_from and current_state is not CoreStates.ALL:
+            if current_state not in allowed_states and current_state is not CoreStates.ALL:
                 raise InvalidStateMachineTransition(operation_name, repr(current_state), allowed_from)
 
             if while_working is not None:
                 _notify_callbacks(self, while_working, self._sm_state, args, kwargs)
                 self._sm_state = while_working
 
+        def fail(self, e, args, kwargs):
+            kwargs.update({'_e': e})
+            _notify_callbacks(self, on_exception, self._sm_state, args, kwargs)
+            self._sm_state = on_exception
+
+        def leave(self, args, kwargs):
+            _notify_callbacks(self, when_done, self._sm_state, args, kwargs)
+            self._sm_state = when_done
+
+        if asyncio.iscoroutinefunction(f):
+            @wraps(f)
+            async def check_transition_and_await(self, *args, **kwargs):
+                enter(self, args, kwargs)
+                try:
+                    result = await f(self, *args, **kwargs)
+                except (Exception, asyncio.CancelledError) as e:
+                    fail(self, e, args, kwargs)
+                    raise
+
+                leave(self, args, kwargs)
+                return result
+            check_transition_and_await._sm_transition = transition
+            return check_transition_and_await
+
+        @wraps(f)
+        def check_transition_and_run(self, *args, **kwargs):
+            enter(self, args, kwargs)
             try:
                 result = f(self, *args, **kwargs)
             except Exception as e:
-                kwargs.update({'_e': e})
-                _notify_callbacks(self, on_exception, self._sm_state, args, kwargs)
-                self._sm_state = on_exception
+                fail(self, e, args, kwargs)
                 raise
 
-            _notify_callbacks(self, when_done, self._sm_state, args, kwargs)
-            self._sm_state = when_done
-
+            leave(self, args, kwargs)
             return result
+        check_transition_and_run._sm_transition = transition
         return check_transition_and_run
     return decorate
 
 
 class StateMachineCallbacks:
-    _sm_callbacks = defaultdict(lambda: dict())
+    _sm_dispatch = None
+    ''':type: Dict[Enum, Tuple[_Subscriber]], the subscribers to notify per target state, ALL included'''
+    _sm_registry_lock = Lock()
+
+    @classmethod
+    def sm_transitions(cls) -> Dict[str, SmTransition]:
+        """The transition table of the class, from its sm_transition-decorated operations"""
+        table = cls.__dict__.get('_sm_transition_table')
+        if table is None:
+            table = OrderedDict()
+            for name, member in inspect.getmembers(cls):
+                transition = getattr(member, '_sm_transition', None)
+                if isinstance(transition, SmTransition):
+                    table[name] = transition
+            cls._sm_transition_table = table
+        return table
+
+    @classmethod
+    def sm_states(cls):
+        """All the states the operations of the class can end up in"""
+        return {state for t in cls.sm_transitions().values()
+                for state in (t.when_done, t.while_working, t.on_exception) if state is not None}
+
+    def _sm_subscribers(self):
+        return self.__dict__.setdefault('_sm_registry', {})
 
     def on_sm_transition(self, callback, tostate=CoreStates.ALL):
-        self._sm_callbacks[tostate][callback] = callback
+        if tostate is not CoreStates.ALL and tostate not in self.sm_states():
+            logger.warning('%s never transitions to %s, %s will never be called',
+                           type(self).__name__, tostate, callback)
+
+        with self._sm_registry_lock:
+            self._sm_subscribers().setdefault(tostate, OrderedDict())[callback] = _Subscriber(callback)
+            self._compile_dispatch()
 
-    def unsubscribe_sm_transition(self, callback, state=None):
-        del self._sm_callbacks[state][callback]
+    def unsubscribe_sm_transition(self, callback, state=CoreStates.ALL):
+        with self._sm_registry_lock:
+            del self._sm_subscribers()[state][callback]
+            self._compile_dispatch()
 
     def on_sm_transitions(self, map=None, enum: Enum=None, **kwargs):
         map = map or {}
@@ -67,22 +136,52 @@ class StateMachineCallbacks:
         for state, cb in map.items():
             self.on_sm_transition(cb, state)
 
+    def _compile_dispatch(self):
+        subscribers = self._sm_subscribers()
+        to_all = tuple(subscribers.get(CoreStates.ALL, {}).values())
 
-def _notify_callbacks(self, tostate, fromstate, args, kwargs):
-    if isinstance(self, StateMachineCallbacks):
-        cb_kwargs = dict(target=self, tostate=tostate, fromstate=fromstate, args=args)
-        cb_kwargs.update(kwargs)
-
-        _notify_callback(self._sm_callbacks[CoreStates.ALL], cb_kwargs)
-        _notify_callback(self._sm_callbacks[tostate], cb_kwargs)
+        dispatch = {CoreStates.ALL: to_all}
+        for state, state_subscribers in subscribers.items():
+            if state is not CoreStates.ALL:
+                dispatch[state] = to_all + tuple(state_subscribers.values())
+        self._sm_dispatch = dispatch  # swapped at once, notifying threads see either the old or the new one
 
 
 def function_args(cb):
-    args = cb.__code__.co_varnames[:cb.__code__.co_argcount]
+    code = cb.__code__
+    args = code.co_varnames[:code.co_argcount + code.co_kwonlyargcount]
     return [k for k in args if k != 'self']
 
 
-def _notify_callback(cbdict, all_kwargs):
-    for cb in cbdict.values():
-        cb_kwargs = {k: all_kwargs[k] for k in function_args(cb) if k in all_kwargs}
-        cb(**cb_kwargs)
+class _Subscriber:
+    """A callback with its argument binding plan, compiled once on subscription"""
+    __slots__ = ('callback', 'args', 'takes_all')
+
+    def __init__(self, callback):
+        self.callback = callback
+        if hasattr(callback, '__code__'):
+            self.args = tuple(function_args(callback))
+            self.takes_all = bool(callback.__code__.co_flags & inspect.CO_VARKEYWORDS)
+        else:
+            parameters = inspect.signature(callback).parameters.values()
+            self.args = tuple(p.name for p in parameters if p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD))
+            self.takes_all = any(p.kind == p.VAR_KEYWORD for p in parameters)
+
+    def __call__(self, all_kwargs):
+        if self.takes_all:
+            return self.callback(**all_kwargs)
+        return self.callback(**{k: all_kwargs[k] for k in self.args if k in all_kwargs})
+
+
+def _notify_callbacks(self, tostate, fromstate, args, kwargs):
+    dispatch = getattr(self, '_sm_dispatch', None)
+    if not dispatch:
+        return
+
+    subscribers = dispatch.get(tostate, dispatch[CoreStates.ALL])
+    if not subscribers:
+        return
+
+    cb_kwargs = dict(kwargs, target=self, tostate=tostate, fromstate=fromstate, args=args)
+    for subscriber in subscribers:
+        subscriber(cb_kwargs)
@@ -0,0 +1,86 @@
+"""Consumption statistics, answered from the hourly and daily usage rollups instead of the raw history."""
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Tuple
+
+from peewee import fn
+
+from mixorama.usage import UsageWriter, UsageResult, RollupPeriod, DrinkRollup, ComponentRollup, RefillRollup, \
+    rebuild_rollups
+
+
+class UsageStats:
+    def __init__(self, writer: UsageWriter = None):
+        """
+        :param writer: runs the queries on the writer's connection, if given
+        """
+        self.writer = writer
+
+    def _run(self, query, *args, **kwargs):
+        if self.writer is not None:
+            return self.writer.call(query, *args, **kwargs).result()
+        return query(*args, **kwargs)
+
+    @staticmethod
+    def _where(rollup, period, since=None, until=None, **equals):
+        where = [rollup.period == period]
+        if since is not None:
+            where.append(rollup.bucket >= period.bucket(since))
+        if until is not None:
+            where.append(rollup.bucket < until)
+        where.extend(getattr(rollup, f) == v for f, v in equals.items() if v is not None)
+        return where
+
+    def drinks(self, period=RollupPeriod.DAY, since: datetime = None, until: datetime = None,
+               name=None, result: UsageResult = None) -> List[Tuple[datetime, str, UsageResult, int]]:
+        """(bucket, drink name, result, count) per period"""
+        def query():
+            r = DrinkRollup
+            return list(r.select(r.bucket, r.name, r.result, r.count)
+                        .where(*self._where(r, period, since, until, name=name, result=result))
+                        .order_by(r.bucket, r.name).tuples())
+        return self._run(query)
+
+    def components(self, period=RollupPeriod.DAY, since: datetime = None, until: datetime = None,
+                   name=None) -> List[Tuple[datetime, str, int, int]]:
+        """(bucket, component name, ml used, times used) per period"""
+        def query():
+            r = ComponentRollup
+            return list(r.select(r.bucket, r.name, r.volume, r.count)
+                        .where(*self._where(r, period, since, until, name=name))
+                        .order_by(r.bucket, r.name).tuples())
+        return self._run(query)
+
+    def refills(self, period=RollupPeriod.DAY, since: datetime = None, until: datetime = None,
+                name=None) -> List[Tuple[datetime, str, int]]:
+        """(bucket, component name, refills) per period"""
+        def query():
+            r = RefillRollup
+            return list(r.select(r.bucket, r.name, r.count)
+                        .where(*self._where(r, period, since, until, name=name))
+                        .order_by(r.bucket, r.name).tuples())
+        return self._run(query)
+
+    def drink_totals(self, since: datetime = None, until: datetime = None,
+                     result: UsageResult = UsageResult.SUCCESS) -> 'OrderedDict[str, int]':
+        """Drinks made since-until by name, the most popular first"""
+        def query():
+            r = DrinkRollup
+            total = fn.SUM(r.count)
+            return OrderedDict(r.select(r.name, total)
+                               .where(*self._where(r, RollupPeriod.DAY, since, until, result=result))
+                               .group_by(r.name).order_by(total.desc()).tuples())
+        return self._run(query)
+
+    def component_totals(self, since: datetime = None, until: datetime = None) -> 'OrderedDict[str, int]':
+        """ml used since-until by component name, the most used first"""
+        def query():
+            r = ComponentRollup
+            total = fn.SUM(r.volume)
+            return OrderedDict(r.select(r.name, total)
+                               .where(*self._where(r, RollupPeriod.DAY, since, until))
+                               .group_by(r.name).order_by(total.desc()).tuples())
+        return self._run(query)
+
+    def rebuild(self):
+        self._run(rebuild_rollups)
@@ -0,0 +1,159 @@
+"""Spans of the drinks, from the bartender's transitions: drink -> component pour -> scales reset/wait.
+
+Every span ends with an outcome and is aggregated into the metrics histograms as it ends. The latest
+drinks are kept whole, with their child spans, for a look at a single slow or failed drink."""
+import asyncio
+import logging
+from collections import deque
+from threading import Lock
+from typing import Dict, List, Optional
+
+import attr
+
+from mixorama import util
+from mixorama.bartender import Bartender, BartenderState, CocktailAbortedException, OutOfComponent
+from mixorama.metrics import REGISTRY, Registry
+from mixorama.scales import ScalesTimeoutException, WaitingForWeightAbortedException
+
+logger = logging.getLogger(__name__)
+
+KEEP_TRACES = 50  # latest drinks
+OVERSHOOT_BUCKETS = (-20, -10, -5, -2, -1, 0, 1, 2, 5, 10, 20)  # gr
+
+
+@attr.s
+class Span:
+    name = attr.ib()
+    ''':type: str, the recipe, the component(s) poured or the scales operation'''
+    kind = attr.ib()
+    ''':type: str, drink, pour, reset or wait'''
+    start = attr.ib()
+    ''':type: float, sec of the util clock'''
+    end = attr.ib(default=None)
+    outcome = attr.ib(default=None)
+    ''':type: str, ok, aborted, timeout, out_of_component or error'''
+    attributes = attr.ib(default=attr.Factory(dict))
+    children = attr.ib(default=attr.Factory(list))
+    ''':type: List[Span]'''
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.end - self.start if self.end is not None else None
+
+    def finish(self, outcome, end=None):
+        self.end = util.now() if end is None else end
+        self.outcome = outcome
+        return self
+
+    def to_dict(self):
+        return attr.asdict(self)
+
+
+def outcome_of(e: BaseException) -> str:
+    if e is None:
+        return 'ok'
+    if isinstance(e, OutOfComponent):
+        return 'out_of_component'
+    cause = e.__cause__ if isinstance(e, CocktailAbortedException) and e.__cause__ else e
+    if isinstance(cause, ScalesTimeoutException):
+        return 'timeout'
+    if isinstance(cause, (WaitingForWeightAbortedException, CocktailAbortedException, asyncio.CancelledError)):
+        return 'aborted'
+    return 'error'
+
+
+class Tracer:
+    def __init__(self, bartender: Bartender, registry: Registry = REGISTRY, keep=KEEP_TRACES):
+        self.bartender = bartender
+        self.traces = deque(maxlen=keep)
+        ''':type: Deque[Span], the finished drinks'''
+        self._drink = None
+        ''':type: Span'''
+        self._pour = None
+        ''':type: Span'''
+        self._lock = Lock()
+
+        self.drinks = registry.counter('mixorama_drinks', 'Drinks made, by outcome', ['outcome'])
+        self.drink_seconds = registry.histogram(
+            'mixorama_drink_duration_seconds', 'From the order to the drink ready, or failing', ['outcome'])
+        self.pours = registry.counter('mixorama_pours', 'Pours, by component and outcome', ['component', 'outcome'])
+        self.pour_seconds = registry.histogram(
+            'mixorama_pour_duration_seconds', 'From opening the valve to the settled weight', ['component'])
+        self.overshoot = registry.histogram(
+            'mixorama_pour_overshoot_grams', 'Settled weight over the target of a pour', ['component'],
+            buckets=OVERSHOOT_BUCKETS)
+        self.scales_seconds = registry.histogram(
+            'mixorama_scales_operation_seconds', 'Scales resets and waits for weight', ['operation', 'outcome'])
+
+        bartender.on_sm_transitions(
+            enum=BartenderState,
+            MAKING=self.on_making,
+            POURING=self.on_pouring,
+            READY=self.on_ready,
+            ABORTED=self.on_aborted)
+        bartender.scales.on_operation(self.on_scales_operation)
+
+    def on_making(self, fromstate, recipe=None, step=None):
+        with self._lock:
+            if fromstate == BartenderState.IDLE:
+                self._drink = Span(recipe.name, 'drink', util.now())
+            elif self._pour is not None:
+                self._end_pour('ok', step)
+
+    def on_pouring(self, fromstate, component=None, components=None):
+        if fromstate != BartenderState.MAKING:
+            return  # back from a progress report
+        components = [component] if component else sorted(components, key=lambda c: c.name)
+        with self._lock:
+            self._pour = Span('+'.join(c.name for c in components), 'pour', util.now(),
+                              attributes=dict(start_weight=self.bartender.glass_weight))
+            if self._drink is not None:
+                self._drink.children.append(self._pour)
+
+    def on_ready(self):
+        with self._lock:
+            self._end_drink('ok')
+
+    def on_aborted(self, fromstate, _e, step=None):
+        outcome = outcome_of(_e)
+        with self._lock:
+            if fromstate == BartenderState.POURING and self._pour is not None:
+                self._end_pour(outcome, step)
+            elif fromstate in (BartenderState.MAKING, BartenderState.ABORTED) and self._drink is not None:
+                self._end_drink(outcome)
+
+    def on_scales_operation(self, operation, started, duration, outcome):
+        self.scales_seconds.observe(duration, operation=operation, outcome=outcome)
+        with self._lock:
+            parent = self._pour or self._drink
+            if parent is not None:
+                span = Span(operation, operation, started).finish(outcome, started + duration)
+                parent.children.append(span)
+
+    def _end_pour(self, outcome, step):
+        pour, self._pour = self._pour.finish(outcome), None
+        self.pours.inc(component=pour.name, outcome=outcome)
+        if outcome != 'ok':
+            return
+
+        self.pour_seconds.observe(pour.duration, component=pour.name)
+        if step is not None:
+            overshoot = self.bartender.glass_weight - pour.attributes['start_weight'] - step.weight
+            pour.attributes['overshoot'] = overshoot
+            self.overshoot.observe(overshoot, component=pour.name)
+
+    def _end_drink(self, outcome):
+        if self._drink is None:
+            return
+        if self._pour is not None:
+            self._end_pour(outcome, None)
+        drink, self._drink = self._drink.finish(outcome), None
+        self.drinks.inc(outcome=outcome)
+        self.drink_seconds.observe(drink.duration, outcome=outcome)
+        self.traces.append(drink)
+        logger.debug('%s %s in %.2f sec', drink.name, outcome, drink.duration)
+
+    def latest(self, n=None) -> List[Dict]:
+        with self._lock:
+            traces = list(self.traces)
+        return [t.to_dict() for t in (traces[-n:] if n else traces)]
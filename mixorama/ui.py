@@ -1,23 +1,30 @@
 import logging
 
-from mixorama.bartender import BartenderState
+from mixorama.bartender import BartenderState, OutOfComponent
 from mixorama.io import Button
+from mixorama.orders import OrderQueue, OrderState
 
 logger = logging.getLogger(__name__)
 
 
-def request_drink(bartender, recipe):
+def request_drink(orders: OrderQueue, recipe, source='button'):
+    """Queues the drink without blocking the caller, e.g. the GPIO event thread"""
     def ui():
-        print('Making a {}'.format(recipe.name))
-        if bartender.make_drink(recipe=recipe):
-            print('Your drink is ready! Please take it from the tray')
-            bartender.serve()
-        else:
-            print('Could not make a drink')
+        try:
+            order = orders.submit(recipe, source)
+            print('Queued a {}, {} orders pending'.format(recipe.name, len(orders)))
+            return order
+        except OutOfComponent:
+            print('Could not make a {}, not enough components'.format(recipe.name))
     return ui
 
 
-def cli_run(menu, bartender):
+def cli_run(menu, orders: OrderQueue):
+    bartender = orders.bartender
+    bartender.on_sm_transition(
+        lambda: print('Your drink is ready! Please take it from the tray'),
+        BartenderState.READY
+    )
     bartender.on_sm_transition(
         lambda tostate, component, volume, done, target:
             print('The Bartender is now {} {} ({}/{})'.format(tostate.name, component, done, volume)),
@@ -39,15 +46,17 @@ def cli_run(menu, bartender):
             print('Strength: %.2f' % drink.strength())
             confirmed = input('Make it? y/n ')
             if confirmed.startswith('y'):
-                request_drink(bartender, drink)()
+                order = request_drink(orders, drink, 'cli')()
+                if order and order.wait() is not OrderState.SERVED:
+                    print('Could not make a drink')
         else:
             print('Unknown cocktail: ' + choice)
 
 
-def bind_hw_buttons(menu, bartender, cfg):
+def bind_hw_buttons(menu, orders: OrderQueue, cfg):
     logger.debug('Assigning buttons')
     for btn, recpie_name in cfg.items():
         if recpie_name is False or recpie_name == 'abort':
-            Button(btn, lambda: bartender.abort() and print('Please discard the glass contents'))
+            Button(btn, lambda: orders.abort() and print('Please discard the glass contents'))
         else:
-            Button(btn, request_drink(bartender, menu[recpie_name]))
+            Button(btn, request_drink(orders, menu[recpie_name]))
@@ -1,6 +1,12 @@
+import atexit
 import datetime
+from collections import OrderedDict
+from concurrent.futures import Future
 from enum import Enum
 import logging
+from queue import Queue, Empty
+from threading import Thread
+from time import time
 
 from peewee import DateTimeField, SqliteDatabase, CharField, IntegerField, fn, Model
 from playhouse.db_url import parse as db_url_parse
@@ -12,6 +18,13 @@ from mixorama.util import EnumField
 
 logger = logging.getLogger(__name__)
 
+WRITE_BATCH_SIZE = 100  # rows per transaction, at most
+WRITE_BATCH_DELAY = 1  # sec, for how long a row waits for others to share its transaction
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'wal'),  # no rollback journal rewrites per transaction
+    ('synchronous', 'normal'),  # WAL stays consistent without an fsync per commit
+)
+
 
 class UsageResult(Enum):
     SUCCESS = 'success'
@@ -19,18 +32,116 @@ class UsageResult(Enum):
     FAILURE = 'failure'
 
 
+class UsageWriter(Thread):
+    """Owns the usage db connection, writing the rows queued by other threads in batched transactions"""
+
+    _STOP = object()
+
+    def __init__(self):
+        super().__init__(name='usage-writer', daemon=True)
+        self._queue = Queue()
+
+    def start(self):
+        super().start()
+        atexit.register(self.stop)
+        return self
+
+    def insert(self, model, **row):
+        """Queues a row, returning immediately"""
+        self._queue.put((model, row))
+
+    def call(self, fn, *args, **kwargs) -> Future:
+        """Runs fn on the writer thread after the rows queued before it are written"""
+        future = Future()
+        self._queue.put((future, lambda: fn(*args, **kwargs)))
+        return future
+
+    def flush(self, timeout=None):
+        return self.call(lambda: None).result(timeout)
+
+    def stop(self):
+        if self.is_alive():
+            self._queue.put((self._STOP, None))
+            self.join()
+
+    def run(self):
+        database.connect(reuse_if_open=True)
+        try:
+            while self._write(self._next_batch()):
+                pass
+        finally:
+            database.close()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time() + WRITE_BATCH_DELAY
+        # only rows wait for company, calls and the stop are awaited by someone
+        while len(batch) < WRITE_BATCH_SIZE and isinstance(batch[-1][0], type):
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time(), 0)))
+            except Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Writes the batch, returns False once it's time to stop"""
+        rows = []
+        for target, item in batch:
+            if isinstance(target, type):
+                rows.append((target, item))
+                continue
+
+            self._insert(rows)
+            rows = []
+            if target is self._STOP:
+                return False
+            self._call(target, item)
+
+        self._insert(rows)
+        return True
+
+    @staticmethod
+    def _insert(rows):
+        if not rows:
+            return
+
+        by_model = {}
+        for model, row in rows:
+            by_model.setdefault(model, []).append(row)
+
+        try:
+            with database.atomic():
+                for model, model_rows in by_model.items():
+                    model.insert_many(model_rows).execute()
+                    roll_up(model, model_rows)
+        except Exception:
+            logger.exception('Could not write %d usage rows', len(rows))
+
+    @staticmethod
+    def _call(future: Future, fn):
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+
+
 class UsageManager:
-    def __init__(self, bartender: Bartender):
-        database.create_tables(ENTITIES)
+    def __init__(self, bartender: Bartender, writer: UsageWriter):
+        self.writer = writer
+        writer.call(create_tables).result()
+        for component in bartender.components:
+            component.on_change(self.on_component_change)
         bartender.on_sm_transitions(
             enum=BartenderState,
             MAKING=self.on_bartender_making,
             READY=self.on_bartender_ready,
             ABORTED=self.on_bartender_aborted)
 
-    def on_bartender_making(self, component=None, volume=None):
+    def on_bartender_making(self, component=None, volume=None, components=None):
         if component and volume:
             self.use(component, volume)
+        for component, volume in (components or {}).items():
+            self.use(component, volume)
 
     def on_bartender_ready(self, recipe=None):
         if recipe:
@@ -42,14 +153,24 @@ class UsageManager:
             result = UsageResult.ABORTED if user_aborted else UsageResult.FAILURE
             self.make(recipe, result)
 
-    @staticmethod
-    def make(drink: Recipe, result: UsageResult):
-        CocktailMixture(name=drink.name, result=result).save()
+    def on_component_change(self, component: Component, event: str, volume):
+        if event == 'fill':
+            self.refill(component)
 
-    @staticmethod
-    def use(component: Component, volume: int):
+    def make(self, drink: Recipe, result: UsageResult):
+        self.writer.insert(CocktailMixture, name=drink.name, result=result, created_at=datetime.datetime.now())
+
+    def use(self, component: Component, volume: int):
         component.use(volume)
-        ComponentUsage(name=component.name, volume=volume).save()
+        self.writer.insert(ComponentUsage, name=component.name, volume=volume, created_at=datetime.datetime.now())
+
+    def refill(self, component: Component):
+        self.writer.insert(Refill, name=component.name, spent_value=component.spent,
+                           created_at=datetime.datetime.now())
+
+    def close(self):
+        """Writes out whatever is queued"""
+        self.writer.stop()
 
 # Peewee-specific below this line
 
@@ -63,30 +184,133 @@ class BaseModel(Model):
 
 
 def configure_db(url, **connect_params):
+    """Initializes the db, the connection is made by the UsageWriter thread"""
     url = db_url_parse(url)
+    url.setdefault('pragmas', SQLITE_PRAGMAS)
     url.update(connect_params)
     database.init(**url)
-    return database.connect(reuse_if_open=True)
+    return database
 
 # app entities below this line
 
 
 class CocktailMixture(BaseModel):
-    name = CharField()
+    name = CharField(index=True)
     result = EnumField(UsageResult)
-    created_at = DateTimeField(default=datetime.datetime.now)
+    created_at = DateTimeField(default=datetime.datetime.now, index=True)
 
 
 class ComponentUsage(BaseModel):
-    name = CharField()
+    name = CharField(index=True)
     volume = IntegerField()
-    created_at = DateTimeField(default=datetime.datetime.now)
+    created_at = DateTimeField(default=datetime.datetime.now, index=True)
 
 
 class Refill(BaseModel):
-    name = CharField()
+    name = CharField(index=True)
     spent_value = IntegerField()
-    created_at = DateTimeField(default=datetime.datetime.now)
+    created_at = DateTimeField(default=datetime.datetime.now, index=True)
+
+
+class RollupPeriod(Enum):
+    HOUR = 'hour'
+    DAY = 'day'
+
+    def bucket(self, moment: datetime.datetime):
+        """The beginning of the period the moment belongs to"""
+        if self is RollupPeriod.DAY:
+            return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class DrinkRollup(BaseModel):
+    period = EnumField(RollupPeriod)
+    bucket = DateTimeField()
+    name = CharField()
+    result = EnumField(UsageResult)
+    count = IntegerField(default=0)
+
+    class Meta:
+        indexes = ((('period', 'bucket', 'name', 'result'), True),)
+
+
+class ComponentRollup(BaseModel):
+    period = EnumField(RollupPeriod)
+    bucket = DateTimeField()
+    name = CharField()
+    volume = IntegerField(default=0)
+    count = IntegerField(default=0)
+
+    class Meta:
+        indexes = ((('period', 'bucket', 'name'), True),)
+
+
+class RefillRollup(BaseModel):
+    period = EnumField(RollupPeriod)
+    bucket = DateTimeField()
+    name = CharField()
+    count = IntegerField(default=0)
+
+    class Meta:
+        indexes = ((('period', 'bucket', 'name'), True),)
+
+
+# raw entity: (its rollup, the rollup key fields, the summed up fields)
+ROLLUPS = {
+    CocktailMixture: (DrinkRollup, ('name', 'result'), ()),
+    ComponentUsage: (ComponentRollup, ('name',), ('volume',)),
+    Refill: (RefillRollup, ('name',), ()),
+}
+
+ENTITIES = [CocktailMixture, ComponentUsage, Refill, DrinkRollup, ComponentRollup, RefillRollup]
+
+
+def roll_up(model, rows):
+    """Adds the rows of a raw entity to its hourly and daily rollups, must run in a transaction"""
+    if model not in ROLLUPS:
+        return
+    rollup, keys, sums = ROLLUPS[model]
+
+    increments = OrderedDict()
+    for row in rows:
+        for period in RollupPeriod:
+            key = (period, period.bucket(row['created_at'])) + tuple(row[k] for k in keys)
+            increment = increments.setdefault(key, [0] * (1 + len(sums)))
+            increment[0] += 1
+            for i, field in enumerate(sums, 1):
+                increment[i] += row[field]
+
+    for key, (count, *totals) in increments.items():
+        fields = dict(zip(('period', 'bucket') + keys, key))
+        update = {rollup.count: rollup.count + count}
+        update.update({getattr(rollup, f): getattr(rollup, f) + total for f, total in zip(sums, totals)})
+
+        where = [getattr(rollup, f) == v for f, v in fields.items()]
+        if not rollup.update(update).where(*where).execute():
+            fields.update(dict(zip(sums, totals)), count=count)
+            rollup.insert(**fields).execute()
+
+
+def rebuild_rollups(chunk_size=1000):
+    """Recomputes all the rollups from the raw entities"""
+    with database.atomic():
+        for model, (rollup, _, _) in ROLLUPS.items():
+            rollup.delete().execute()
+            rows = []
+            for row in model.select().dicts().iterator():
+                rows.append(row)
+                if len(rows) >= chunk_size:
+                    roll_up(model, rows)
+                    rows = []
+            roll_up(model, rows)
+
 
+def create_tables():
+    database.create_tables(ENTITIES)
 
-ENTITIES = [CocktailMixture, ComponentUsage, Refill]
+    # rolling up the history recorded before the rollups existed
+    for model, (rollup, _, _) in ROLLUPS.items():
+        if not rollup.select().exists() and model.select().exists():
+            logger.info('Building usage rollups from the existing history')
+            rebuild_rollups()
+            break
@@ -1,5 +1,6 @@
 from collections import defaultdict
-from datetime import datetime
+from contextlib import contextmanager
+from time import perf_counter, sleep as system_sleep, time as system_time
 from enum import Enum
 from peewee import CharField
 import logging
@@ -7,11 +8,50 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class SystemClock:
+    def time(self):
+        return system_time()
+
+    def sleep(self, seconds):
+        system_sleep(seconds)
+
+
+class VirtualClock:
+    """Time which passes only when someone sleeps, e.g. a simulator, so that it takes no time at all"""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+
+clock = SystemClock()
+''':type: Union[SystemClock, VirtualClock], the time of the timeouts, the samples and the sleeps'''
+
+
+def set_clock(new_clock):
+    global clock
+    clock = new_clock
+    return new_clock
+
+
+def now():
+    return clock.time()
+
+
+def sleep(seconds):
+    clock.sleep(seconds)
+
+
 def make_timeout(delay_ms):
-    starttime = datetime.now().timestamp()
+    starttime = now()
 
     def time_is_out():
-        return datetime.now().timestamp() > starttime + (delay_ms/1000)
+        return now() > starttime + (delay_ms/1000)
 
     return time_is_out
 
@@ -24,6 +64,34 @@ class DefaultFactoryDict(defaultdict):
         return value
 
 
+class StartupTimer:
+    """Times the startup phases, so that boot time regressions show up in the log"""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.phases = []
+        ''':type: List[Tuple[str, float]], (phase, seconds)'''
+        self.reported = False
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, perf_counter() - start))
+
+    def report(self, until='ready'):
+        """Logs the phases and the total time since the timer was created, once"""
+        if self.reported:
+            return
+        self.reported = True
+
+        total = perf_counter() - self.started
+        phases = ''.join('\n  {:<24} {:8.1f} ms'.format(name, seconds * 1000) for name, seconds in self.phases)
+        logger.info('Startup took %.1f ms until %s:%s', total * 1000, until, phases)
+
+
 class MaxObserver:
     value = 0
 
@@ -25,6 +25,11 @@ install_requires = [
     'peewee==3.7.1'
 ]
 
+extras_require = {
+    'filters': ['numpy'],  # numpy-backed window filters of the scales samples
+    'thumbnails': ['Pillow'],  # recipe images pre-scaled to the preview size
+}
+
 tests_require = [
 ]
 
@@ -40,6 +45,7 @@ if __name__ == "__main__":
         long_description=read("README.md"),
         packages=find_packages(),
         install_requires=install_requires,
+        extras_require=extras_require,
         tests_require=tests_require,
         entry_points='''
             [console_scripts]
@@ -0,0 +1,46 @@
+import pytest
+
+from mixorama import util
+from mixorama.bartender import Bartender, BartenderState, CocktailAbortedException
+from mixorama.recipes import Component, Recipe
+from mixorama.scales import Scales, WaitingForWeightAbortedException
+from mixorama.simulator import SimulatedValve, Simulator
+
+
+@pytest.fixture
+def bartender():
+    clock = util.clock
+    util.set_clock(util.VirtualClock())
+    gin, tonic = Component('Gin'), Component('Tonic water')
+    bar = {gin: SimulatedValve(1), tonic: SimulatedValve(2)}
+    compressor = SimulatedValve(3)
+    bartender = Bartender(bar, compressor, Scales(impl=Simulator(bar, compressor, seed=1)))
+    yield bartender
+    bartender.engine.stop()
+    util.set_clock(clock)
+
+
+def test_simulated_drink_is_made(bartender):
+    gin, tonic = bartender.components
+    assert bartender.make_drink(Recipe('Gin tonic', [(gin, 40), (tonic, 40)]))
+    assert bartender._sm_state == BartenderState.READY
+    assert all(volume > 0 for volume in bartender.scales.scales.poured.values())
+    assert abs(bartender.glass_weight - bartender.scales.scales.content) < 1
+
+
+def test_abort_stops_a_simulated_drink(bartender):
+    gin, tonic = bartender.components
+    simulator = bartender.scales.scales
+    bartender.on_sm_transitions(
+        enum=BartenderState,
+        POURING=lambda fromstate: fromstate == BartenderState.MAKING and bartender.abort())
+
+    with pytest.raises(CocktailAbortedException) as e:
+        bartender.make_drink(Recipe('Gin tonic', [(gin, 40), (tonic, 40)]))
+
+    assert isinstance(e.value.__cause__, WaitingForWeightAbortedException)
+    assert bartender._sm_state == BartenderState.ABORTED
+    assert simulator.poured[gin] < 40
+    assert simulator.poured[tonic] == 0
+    assert not any(valve.is_open for valve in bartender.components.values())
+    assert not bartender.compressor.is_open